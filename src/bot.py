@@ -21,7 +21,10 @@ class DNDBot(Bot):
         self.error_activity = Activity(name='! other Characters (+help)', type=0)
         self.error_string = 'Sorry, something went wrong. We will look into it.'
         self.mainguild = None
-        self.state = DBConnector(db_path='sqlite:///../state/state.db.sqlite3')
+        self.state = DBConnector(
+            db_path='sqlite:///../state/state.db.sqlite3',
+            pragmas=self.config.get('sqlite_pragmas'),
+        )
 
     async def start(self, *args, **kwargs):
         self.session = ClientSession()
@@ -30,6 +33,7 @@ class DNDBot(Bot):
     async def close(self):
         await self.session.close()
         await super().close()
+        self.state.close()
 
     async def log_error(self, error, error_source=None):
         self.last_errors.append((
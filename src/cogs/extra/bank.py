@@ -4,15 +4,29 @@ It will add commands to manage a guild bank.
 # pylint: disable=E0402, E0211
 import typing
 from datetime import datetime, timezone
-from discord.ext import commands
+from itertools import groupby
+from operator import attrgetter
+from discord.ext import commands, tasks
 from discord.utils import get
-from discord import Embed
-from .models.transaction_model import TransactionDB
+from discord import Embed, File
+from .models.core import DBError
+from .models.transaction_model import (
+    TransactionDB, Coins, COPPER_VALUE, CURRENCIES, EXPORT_FORMATS,
+)
 from .models.character_model import CharacterDB
-from .models.user_model import UserDB
+from .utils.pager import ReactionPager, fill_embed
 
-CURRENCIES = ('platinum', 'gold', 'electrum', 'silver', 'copper')
 CURRENCIES_SHORT = tuple(s[0] for s in CURRENCIES)
+HISTORY_PAGE_SIZE = 12
+PENDING_PAGE_SIZE = 10
+FIELD_VALUE_MAX_LENGTH = 1024
+# Upload limit of discord without boosts
+EXPORT_MAX_SIZE = 8 * 1024 * 1024
+
+
+def format_copper(value):
+    """Format an amount of copper pieces as its worth in gold"""
+    return f'{value / COPPER_VALUE["gold"]:,.2f} gp'
 
 
 class Bank(commands.Cog, name='Bank'):
@@ -25,7 +39,21 @@ class Bank(commands.Cog, name='Bank'):
             self.emoji = None
         self.TransactionDB = TransactionDB(client)
         self.CharacterDB = CharacterDB(client)
-        self.UserDB = UserDB(client)
+        self.create_checkpoints.start()
+
+    def cog_unload(self):
+        self.create_checkpoints.cancel()
+
+    @tasks.loop(hours=6)
+    async def create_checkpoints(self):
+        try:
+            await self.TransactionDB.create_checkpoints()
+        except Exception as e:  # pylint: disable=broad-except
+            await self.client.log_error(e, 'Bank.create_checkpoints')
+
+    @create_checkpoints.before_loop
+    async def before_create_checkpoints(self):
+        await self.client.wait_until_ready()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -38,31 +66,43 @@ class Bank(commands.Cog, name='Bank'):
             return ctx.bot.user_is_admin(ctx.author)
         return commands.check(predicate)
 
-    def get_balance(self, account):
-        """Get the balance of an account as a dict of currencies"""
-        coins = {c: 0 for c in CURRENCIES}
-        transactions = self.TransactionDB.query_all(receiver_id=account, confirmed=True)
-        if not transactions:
+    async def get_balance(self, account):
+        """Get the balance of an account as Coins"""
+        balance = await self.TransactionDB.get_balance(account)
+        if balance is None:
             raise commands.BadArgument('There are no Transactions on this account yet')
-        for transaction in transactions:
-            for c in CURRENCIES:
-                coins[c] += getattr(transaction, c) or 0
-        return coins
+        return balance
 
     async def print_balance(self, ctx, account):
         """Show the balance of an account"""
-        coins = self.get_balance(account)
-        char = self.CharacterDB.query_one(id=account)
+        coins = await self.get_balance(account)
+        char = await self.CharacterDB.query_one(id=account)
         e = Embed()
         coins_string = [f'{v} {self.emoji[k]}' for k, v in coins.items()]
         e.add_field(name=f'Balance ({char.name}):', value=' | '.join(coins_string))
+        pending = await self.TransactionDB.sum_for_account(account, confirmed=False)
+        if pending:
+            pending_string = [f'{v} {self.emoji[k]}' for k, v in pending.items()]
+            e.add_field(name='Pending:', value=' | '.join(pending_string), inline=False)
         await ctx.send(embed=e)
 
-    def format_transaction(self, transaction):
+    async def format_transaction(self, transaction):
         """Format a Transaction for being displayed as an embed field"""
-        coins = {
-            c: getattr(transaction, c) if getattr(transaction, c) else 0 for c in CURRENCIES
-        }
+        formatted = await self.format_transactions([transaction])
+        return formatted[0]
+
+    async def format_transactions(self, transactions):
+        """Format several Transactions, all referenced characters are loaded at once"""
+        char_ids = set()
+        for transaction in transactions:
+            char_ids.add(transaction.receiver_id)
+            char_ids.add(transaction.sender_id)
+        chars = await self.CharacterDB.query_many(char_ids)
+        return [self.format_transaction_with(transaction, chars) for transaction in transactions]
+
+    def format_transaction_with(self, transaction, chars):
+        """Format a Transaction using a dict of the referenced characters by id"""
+        coins = Coins.from_row(transaction)
         date = transaction.date.split('.')[0].replace('T', ' ') + ' UTC'
         # user = self.client.get_user(transaction.user_id)
         # user_str = user.name + '#' + user.discriminator
@@ -71,20 +111,23 @@ class Bank(commands.Cog, name='Bank'):
         confirmed = transaction.confirmed
         # - {user_str}'
         title = f'{"(Pending) " * (not confirmed)}ID:{transaction_id} | {description}'
-        body = [f'**{coins[c]}** {self.emoji[c]} ' if coins[c] else '' for c in CURRENCIES]
-        receiver = self.CharacterDB.query_one(id=transaction.receiver_id)
+        body = [f'**{v}** {self.emoji[k]} ' if v else '' for k, v in coins.items()]
+
+        def display_name(char_id):
+            char = chars.get(char_id)
+            return char.display_name if char else f'#{char_id}'
+
         if transaction.sender_id == transaction.receiver_id:
-            body.append(f'\nEin/Auszahlung: {receiver.display_name}')
+            body.append(f'\nEin/Auszahlung: {display_name(transaction.receiver_id)}')
         else:
-            sender = self.CharacterDB.query_one(id=transaction.sender_id)
-            body.append(f'\nVon: {sender.display_name}')
-            body.append(f'\nAn: {receiver.display_name}')
+            body.append(f'\nVon: {display_name(transaction.sender_id)}')
+            body.append(f'\nAn: {display_name(transaction.receiver_id)}')
         body.append(f'\n{date}')
 
         return (title, ''.join(body))
 
     def parse_transaction_string(self, transaction_string):
-        """Parse a transaction string and return a dict of coins"""
+        """Parse a transaction string and return the Coins"""
         for c in transaction_string:
             if (c not in ',+-1234567890') and (c not in CURRENCIES_SHORT):
                 raise commands.BadArgument('Invalid character in transaction ' + c)
@@ -102,106 +145,113 @@ class Bank(commands.Cog, name='Bank'):
             currency = CURRENCIES[CURRENCIES_SHORT.index(currency)]
             coins[currency] = amount
 
-        return coins
+        return Coins(**coins)
 
     async def create_transaction(
         self, user_id, transaction_string, description, sender_id, receiver_id, confirm
     ):
         """Create a transaction (if money was sent create another one in the target account)
 
-        If there is not enough money in either account -> tevert transactions and raise error"""
+        If there is not enough money in either account nothing is written and an error is raised"""
         if not description or not transaction_string:
             raise commands.BadArgument('Please provide a transaction string and a description')
 
         coins = self.parse_transaction_string(transaction_string)
 
-        transaction = self.TransactionDB.create_new(
-            date=datetime.now(tz=timezone.utc).isoformat(),
-            user_id=user_id,
-            receiver_id=receiver_id,
-            sender_id=sender_id,
-            description=description,
-            confirmed=confirm,
-            platinum=None,
-            electrum=None,
-            gold=None,
-            silver=None,
-            copper=None,
-            linked=None
-        )
-
-        for currency, amount in coins.items():
-            setattr(transaction, currency, amount)
-
-        receiver_balance = self.get_balance(receiver_id)
-        if any(amount < 0 for amount in receiver_balance.values()):
-            await transaction.delete()
-            raise commands.BadArgument('Not enough money in account')
-
-        if sender_id != receiver_id:
-            transaction2 = self.TransactionDB.create_new(
+        try:
+            transaction = await self.TransactionDB.create_transfer(
                 date=datetime.now(tz=timezone.utc).isoformat(),
                 user_id=user_id,
-                receiver_id=sender_id,
-                sender_id=receiver_id,
+                sender_id=sender_id,
+                receiver_id=receiver_id,
+                coins=coins,
                 description=description,
                 confirmed=confirm,
-                platinum=None,
-                electrum=None,
-                gold=None,
-                silver=None,
-                copper=None,
-                linked=transaction.id,
             )
-            for currency, amount in coins.items():
-                setattr(transaction2, currency, amount*-1)
-
-            transaction.linked = transaction2.id
-
-        seender_balance = self.get_balance(receiver_id)
-        if any(amount < 0 for amount in seender_balance.values()):
-            await transaction.delete()
-            raise commands.BadArgument('Not enough money in account')
+        except DBError as e:
+            raise commands.BadArgument(str(e))
 
         return transaction
 
     async def print_log(self, ctx, account, search_string=None):
-        """Print the log for an account to a ctx"""
-        e = Embed(title='Transaction Log')
-        transactions = self.TransactionDB.get_history_for_account(
-            receiver_id=account,
-            search_string=search_string
-        )
-        if not transactions:
-            raise commands.BadArgument(f'No Transactions for Account #{account}')
-        for transaction in transactions:
-            title, body = self.format_transaction(transaction)
-            e.add_field(inline=True, name=title, value=body)
-        await ctx.send(embed=e)
+        """Print the log for an account to a ctx, one page at a time
+
+        Searches use the full text index (best match first) when the database has one"""
+        ranked = bool(search_string) and self.TransactionDB.full_text_search
+
+        async def fetch_page(cursor):
+            # One extra row tells if there is another page
+            if ranked:
+                transactions = await self.TransactionDB.search_history(
+                    receiver_id=account,
+                    search_string=search_string,
+                    limit=HISTORY_PAGE_SIZE + 1,
+                    offset=cursor or 0,
+                )
+            else:
+                transactions = await self.TransactionDB.get_history_for_account(
+                    receiver_id=account,
+                    limit=HISTORY_PAGE_SIZE + 1,
+                    before_id=cursor,
+                    search_string=search_string,
+                )
+            if not transactions:
+                raise commands.BadArgument(f'No Transactions for Account #{account}')
+            e = Embed(title='Transaction Log')
+            for title, body in await self.format_transactions(transactions[:HISTORY_PAGE_SIZE]):
+                e.add_field(inline=True, name=title, value=body)
+            next_cursor = None
+            if len(transactions) > HISTORY_PAGE_SIZE:
+                if ranked:
+                    next_cursor = (cursor or 0) + HISTORY_PAGE_SIZE
+                else:
+                    next_cursor = transactions[HISTORY_PAGE_SIZE - 1].id
+            return e, next_cursor
+
+        await ReactionPager(self.client, fetch_page).start(ctx)
 
     async def print_pending(self, ctx):
-        """Print all pending transactions to a ctx"""
-        e = Embed(title='Pending Transactions')
-        transactions = self.TransactionDB.query_all(confirmed=0)
-        if not transactions:
-            raise commands.BadArgument('No Pending Transactions')
-        for transaction in transactions:
-            title, body = self.format_transaction(transaction)
-            e.add_field(inline=False, name=title, value=body)
-        await ctx.send(embed=e)
+        """Print the pending transactions to a ctx, one page at a time"""
+        async def fetch_page(after_id):
+            # One extra row tells if there is another page
+            transactions = await self.TransactionDB.get_pending(
+                limit=PENDING_PAGE_SIZE + 1,
+                after_id=after_id,
+            )
+            if not transactions:
+                raise commands.BadArgument('No Pending Transactions')
+            e = Embed(title='Pending Transactions')
+            shown = fill_embed(e, await self.format_transactions(transactions[:PENDING_PAGE_SIZE]))
+            next_cursor = None
+            if len(transactions) > shown:
+                next_cursor = transactions[shown - 1].id
+            return e, next_cursor
+
+        await ReactionPager(self.client, fetch_page).start(ctx)
+
+    async def confirm_transactions(self, transaction_ids):
+        """Confirm transactions (and the linked ones in the target accounts) at once"""
+        messages = {
+            'confirmed': 'Confirmed transaction: {}',
+            'already confirmed': 'Transaction {} was already confirmed',
+            'unknown': 'Unknown transaction: {}',
+        }
+        report = await self.TransactionDB.confirm_many(transaction_ids)
+        return [messages[status].format(transaction_id) for transaction_id, status, _ in report]
 
-    async def confirm_transaction(self, transaction_id, check_linked=True):
-        """Confirm a transaction (if money was sent confirm another one in the target account)"""
-        res = ''
-        transaction = self.TransactionDB.query_one(id=transaction_id)
-        if not transaction:
-            return f'Unknown transaction: {transaction_id}'
-        if transaction.confirmed:
-            return f'Transaction {transaction_id} was already confirmed'
-        transaction.confirmed = True
-        res = f'Confirmed transaction: {transaction_id}'
-        if transaction.linked and check_linked:
-            res += '\n' + await self.confirm_transaction(transaction.linked, check_linked=False)
+    async def delete_transactions(self, transaction_ids, account_id=None):
+        """Delete transactions (and the linked ones in the target accounts) at once"""
+        res = []
+        report = await self.TransactionDB.delete_many(transaction_ids, account_id=account_id)
+        for transaction_id, status, linked_to in report:
+            if status == 'unknown':
+                res.append(f'{transaction_id}: Unknown transaction')
+            elif status == 'forbidden':
+                res.append(f'{transaction_id}: This is not a deposit/withdraw of your character')
+            elif linked_to is not None:
+                res.append(f'{transaction_id}: Success - deleted (linked to {linked_to})')
+            else:
+                res.append(f'{transaction_id}: Success - deleted')
         return res
 
     @commands.group(
@@ -235,7 +285,7 @@ class Bank(commands.Cog, name='Bank'):
         )
         e = Embed(
             title=f'Transaction added to Bank',
-            description='\n'.join(self.format_transaction(transaction))
+            description='\n'.join(await self.format_transaction(transaction))
         )
         await ctx.send(embed=e)
         await self.print_balance(ctx, account=1)
@@ -246,7 +296,7 @@ class Bank(commands.Cog, name='Bank'):
     )
     @is_admin()
     async def bank_history(self, ctx, account: typing.Optional[int] = 1, *, search_string=None):
-        """View the bank transaction history"""
+        """View the bank transaction history (use the reactions to flip pages)"""
         await self.print_log(ctx, account, search_string)
 
     @bank.command(
@@ -256,13 +306,9 @@ class Bank(commands.Cog, name='Bank'):
     @is_admin()
     async def bank_delete(self, ctx, transaction_ids: commands.Greedy[int]):
         """Delete transactions"""
-        res = []
-        for transaction_id in transaction_ids:
-            transaction = self.TransactionDB.query_one(id=transaction_id)
-            if not transaction:
-                res.append(f'{transaction_id}: Unknown transaction')
-            status = await transaction.delete()
-            res.append(f'{transaction_id}:Success - {status} transactions deleted.')
+        if not transaction_ids:
+            raise commands.BadArgument('Please specify at least one transaction id')
+        res = await self.delete_transactions(transaction_ids)
         await ctx.send('```\n' + '\n'.join(res) + '\n```')
 
     @bank.command(
@@ -270,7 +316,7 @@ class Bank(commands.Cog, name='Bank'):
     )
     @is_admin()
     async def bank_pending(self, ctx):
-        """View all pending transactions"""
+        """View all pending transactions (use the reactions to flip pages)"""
         await self.print_pending(ctx)
 
     @bank.command(
@@ -279,11 +325,9 @@ class Bank(commands.Cog, name='Bank'):
     @is_admin()
     async def bank_confirm_transaction(self, ctx, transaction_ids: commands.Greedy[int]):
         """Confirm a pending transaction"""
-        result = []
         if not transaction_ids:
             raise commands.BadArgument('Please specify at least one transaction id')
-        for transaction_id in transaction_ids:
-            result.append(await self.confirm_transaction(transaction_id))
+        result = await self.confirm_transactions(transaction_ids)
         await ctx.send('```\n' + '\n'.join(result) + '```')
 
     @bank.command(
@@ -292,12 +336,145 @@ class Bank(commands.Cog, name='Bank'):
     @is_admin()
     async def bank_show_transaction(self, ctx, transaction_id):
         """Display a specific transaction"""
-        transaction = self.TransactionDB.query_one(id=transaction_id)
+        transaction = await self.TransactionDB.query_one(id=transaction_id)
         e = Embed(title=f'Transaction {transaction_id}')
-        title, body = self.format_transaction(transaction)
+        title, body = await self.format_transaction(transaction)
         e.add_field(inline=False, name=title, value=body)
         await ctx.send(embed=e)
 
+    @bank.command(
+        name='verify',
+    )
+    @is_admin()
+    async def bank_verify(self, ctx):
+        """Check the stored account balances and checkpoints against the transactions"""
+        drift = await self.TransactionDB.verify_balances()
+        checkpoint_drift = await self.TransactionDB.verify_checkpoints()
+        if not drift and not checkpoint_drift:
+            await ctx.send('All account balances and checkpoints are consistent')
+            return
+
+        def changes(stored, expected):
+            return ', '.join(
+                f'{c}: {old} -> {new}'
+                for (c, old), (_, new) in zip(stored.items(), expected.items()) if old != new
+            )
+
+        res = []
+        if drift:
+            res.append(f'{len(drift)} accounts differ (stored -> expected):')
+            for account_id, stored, expected in drift:
+                res.append(f'{account_id}: {changes(stored, expected)}')
+        if checkpoint_drift:
+            res.append(f'{len(checkpoint_drift)} checkpoints differ (stored -> expected):')
+            for account_id, transaction_id, stored, expected in checkpoint_drift:
+                res.append(f'{account_id} @ {transaction_id}: {changes(stored, expected)}')
+        if checkpoint_drift:
+            res.append('Use +bank rebuild full to drop the checkpoints and fix the stored balances')
+        else:
+            res.append('Use +bank rebuild to fix the stored balances')
+        await ctx.send('```\n' + '\n'.join(res) + '\n```')
+
+    @bank.command(
+        name='rebuild',
+    )
+    @is_admin()
+    async def bank_rebuild(self, ctx, mode=None):
+        """Recompute all stored account balances starting at the latest checkpoints
+
+        `+bank rebuild full` drops all checkpoints and recomputes from the first transaction"""
+        num_accounts = await self.TransactionDB.rebuild_balances(full=mode == 'full')
+        await ctx.send(f'Rebuilt the balances of {num_accounts} accounts')
+
+    @bank.command(
+        name='stats',
+    )
+    @is_admin()
+    async def bank_stats(self, ctx, months: int = 6):
+        """Show the coin supply of all accounts and the transaction volume per month"""
+        num_accounts, supply, total = await self.TransactionDB.get_supply()
+        volume = await self.TransactionDB.get_volume(periods=max(1, min(months, 24)))
+        e = Embed(title='Bank Statistics')
+        supply_string = ' | '.join(f'{v} {self.emoji[k]}' for k, v in supply.items())
+        e.add_field(
+            inline=False,
+            name=f'Coin supply ({num_accounts} accounts):',
+            value=f'{supply_string}\nWorth: {format_copper(total)}',
+        )
+        if volume:
+            e.add_field(
+                inline=False,
+                name='Volume (month: transactions | in | out):',
+                value='\n'.join(
+                    f'{month}: {count} | {format_copper(value_in)} | {format_copper(value_out)}'
+                    for month, count, value_in, value_out in volume
+                ),
+            )
+        await ctx.send(embed=e)
+
+    @bank.command(
+        name='top',
+        aliases=['leaderboard'],
+    )
+    @is_admin()
+    async def bank_top(self, ctx, limit: int = 10):
+        """Show the accounts with the highest balance (by worth)"""
+        leaderboard = await self.TransactionDB.get_leaderboard(limit=max(1, min(limit, 25)))
+        if not leaderboard:
+            raise commands.BadArgument('There are no Transactions yet')
+        e = Embed(title='Richest Accounts')
+        for rank, (account_id, display_name, coins, value) in enumerate(leaderboard, 1):
+            coins_string = ' | '.join(f'{v} {self.emoji[k]}' for k, v in coins.items() if v)
+            e.add_field(
+                inline=False,
+                name=f'{rank}. {display_name or "Unknown"} (#{account_id}) - {format_copper(value)}',
+                value=coins_string or '-',
+            )
+        await ctx.send(embed=e)
+
+    @bank.command(
+        name='export',
+    )
+    @is_admin()
+    async def bank_export(
+        self, ctx, account: typing.Optional[int] = None, since=None, file_format='csv'
+    ):
+        """Export transactions as a gzipped csv/jsonl file `+help bank export`
+
+        Exports all accounts if no account is given, since is a date like 2021-01-31.
+        example `+bank export 12 2021-01-01 jsonl`
+        example `+bank export jsonl`
+        """
+        # The date can be left out in front of the format
+        if since is not None and since.lower() in EXPORT_FORMATS:
+            since, file_format = None, since
+        file_format = file_format.lower()
+        if file_format not in EXPORT_FORMATS:
+            raise commands.BadArgument(f'Format must be one of {", ".join(EXPORT_FORMATS)}')
+        if since is not None:
+            try:
+                since = datetime.fromisoformat(since).date().isoformat()
+            except ValueError:
+                raise commands.BadArgument(f'Invalid date {since} (use YYYY-MM-DD)')
+
+        buffer, num_rows = await self.TransactionDB.export(
+            receiver_id=account, since=since, file_format=file_format
+        )
+        if not num_rows:
+            raise commands.BadArgument('No Transactions to export')
+        size_limit = ctx.guild.filesize_limit if ctx.guild else EXPORT_MAX_SIZE
+        if buffer.getbuffer().nbytes > size_limit:
+            raise commands.BadArgument(
+                'The export is too big for an upload, please limit it to an account or a date'
+            )
+        filename = '_'.join(
+            str(part) for part in ('transactions', account, since) if part is not None
+        )
+        await ctx.send(
+            f'Exported {num_rows} transactions',
+            file=File(fp=buffer, filename=f'{filename}.{file_format}.gz'),
+        )
+
     @bank.command(
         name='send',
     )
@@ -308,7 +485,7 @@ class Bank(commands.Cog, name='Bank'):
         if receiver_account_nr == 1:
             raise commands.BadArgument('You cannot send money to yourself')
 
-        receiver = self.CharacterDB.query_one(id=receiver_account_nr)
+        receiver = await self.CharacterDB.query_one(id=receiver_account_nr)
         if not receiver:
             raise commands.BadArgument('Receiver not found')
 
@@ -322,7 +499,7 @@ class Bank(commands.Cog, name='Bank'):
         )
         e = Embed(
             title=f'Transaction added from Bank to {receiver.name}',
-            description='\n'.join(self.format_transaction(transaction))
+            description='\n'.join(await self.format_transaction(transaction))
         )
         await ctx.send(embed=e)
 
@@ -332,21 +509,30 @@ class Bank(commands.Cog, name='Bank'):
     @is_admin()
     async def bank_show_accounts(self, ctx):
         """Show all account holders (characters that are not NPCs)"""
-        e = Embed(title='Accounts')
-        users = self.UserDB.query_all()
-        for user in users:
-            member = self.client.get_user(user.id)
+        holders = await self.CharacterDB.query_account_holders()
+        if not holders:
+            raise commands.BadArgument('There are no accounts yet')
+        fields = []
+        for user_id, chars in groupby(holders, key=attrgetter('user_id')):
+            member = self.client.get_user(user_id)
             username = member.display_name if member else 'Unknown'
-            chars = self.CharacterDB.query_all(user_id=user.id)
-            if not chars:
-                continue
-            c_list = [
-                f'{char.id}: {char.display_name} ({char.name})' for char in chars if (char.id == 1 or not char.npc_status)
-            ]
-            if c_list:
-                e.add_field(name=username, value='\n'.join(c_list), inline=True)
-
-        await ctx.send(embed=e)
+            value = ''
+            for char in chars:
+                line = f'{char.id}: {char.display_name} ({char.name})'
+                if value and len(value) + len(line) >= FIELD_VALUE_MAX_LENGTH:
+                    fields.append((username, value))
+                    value = ''
+                value = f'{value}\n{line}' if value else line
+            fields.append((username, value))
+
+        async def fetch_page(start):
+            start = start or 0
+            e = Embed(title='Accounts')
+            shown = fill_embed(e, fields[start:], inline=True)
+            next_start = start + shown if start + shown < len(fields) else None
+            return e, next_start
+
+        await ReactionPager(self.client, fetch_page).start(ctx)
 
     @commands.group(
         name='account',
@@ -355,7 +541,7 @@ class Bank(commands.Cog, name='Bank'):
     )
     async def account(self, ctx):
         """View and control your account `+help account`"""
-        character = self.CharacterDB.query_active_char(user_id=ctx.author.id)
+        character = await self.CharacterDB.query_active_char(user_id=ctx.author.id)
         if not character:
             raise commands.BadArgument('No active character found')
         await self.print_balance(ctx, character.id)
@@ -370,7 +556,7 @@ class Bank(commands.Cog, name='Bank'):
         example `+account 2g,5s Pay for last mission`
         example `+account -2g,-5s Bought food for the kitchen`
         """
-        character = self.CharacterDB.query_active_char(user_id=ctx.author.id)
+        character = await self.CharacterDB.query_active_char(user_id=ctx.author.id)
         if not character:
             raise commands.BadArgument('No active character found')
 
@@ -384,7 +570,7 @@ class Bank(commands.Cog, name='Bank'):
         )
         e = Embed(
             title=f'Transaction added to account of {character.name}',
-            description='\n'.join(self.format_transaction(transaction))
+            description='\n'.join(await self.format_transaction(transaction))
         )
         await ctx.send(embed=e)
         await self.print_balance(ctx, account=character.id)
@@ -394,8 +580,8 @@ class Bank(commands.Cog, name='Bank'):
         aliases=['log'],
     )
     async def account_history(self, ctx):
-        """View your account's transaction history"""
-        character = self.CharacterDB.query_active_char(user_id=ctx.author.id)
+        """View your account's transaction history (use the reactions to flip pages)"""
+        character = await self.CharacterDB.query_active_char(user_id=ctx.author.id)
         if not character:
             raise commands.BadArgument('No active character found')
         await self.print_log(ctx, character.id)
@@ -406,22 +592,13 @@ class Bank(commands.Cog, name='Bank'):
     )
     async def account_delete(self, ctx, transaction_ids: commands.Greedy[int]):
         """Delete one of your own deposit/withdraw transactions"""
-        character = self.CharacterDB.query_active_char(user_id=ctx.author.id)
+        character = await self.CharacterDB.query_active_char(user_id=ctx.author.id)
         if not character:
             raise commands.BadArgument('No active character found')
 
-        res = []
-        for transaction_id in transaction_ids:
-            transaction = self.TransactionDB.query_one(id=transaction_id)
-            if not transaction:
-                res.append(f'{transaction_id}:Unknown transaction')
-
-            if not transaction.sender_id == transaction.receiver_id == character.id:
-                res.append(f'{transaction_id}: This is not a deposit/withdraw of your character')
-
-            status = await transaction.delete()
-            res.append(f'{transaction_id}: Success - {status} transaction deleted.')
-
+        if not transaction_ids:
+            raise commands.BadArgument('Please specify at least one transaction id')
+        res = await self.delete_transactions(transaction_ids, account_id=character.id)
         await ctx.send('```\n' + '\n'.join(res) + '\n```')
 
     @account.command(
@@ -434,14 +611,14 @@ class Bank(commands.Cog, name='Bank'):
         if '-' in transaction_string:
             raise commands.BadArgument('You can only send positive amounts')
 
-        character = self.CharacterDB.query_active_char(user_id=ctx.author.id)
+        character = await self.CharacterDB.query_active_char(user_id=ctx.author.id)
         if not character:
             raise commands.BadArgument('No active character found')
 
         if character.id == receiver_account_nr:
             raise commands.BadArgument('You cannot send money to yourself')
 
-        receiver = self.CharacterDB.query_one(id=receiver_account_nr)
+        receiver = await self.CharacterDB.query_one(id=receiver_account_nr)
         if not receiver:
             raise commands.BadArgument('Receiver not found')
 
@@ -455,7 +632,7 @@ class Bank(commands.Cog, name='Bank'):
         )
         e = Embed(
             title=f'Transaction added from {character.name} to {receiver.name}',
-            description='\n'.join(self.format_transaction(transaction))
+            description='\n'.join(await self.format_transaction(transaction))
         )
         await ctx.send(embed=e)
 
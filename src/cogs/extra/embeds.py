@@ -2,13 +2,21 @@
 It will add commands to manage embeds.
 """
 # pylint: disable=E0402, E0211
+import asyncio
 import json
+from collections import Counter
 from io import BytesIO
 from datetime import datetime, timezone
 from discord.ext import commands
 from discord import TextChannel, File
+from discord import errors as discord_errors
 from .models.core import DBError, ModelError
-from .models.embed_model import EmbedDB
+from .models.embed_model import EmbedDB, track_message, forget_message
+
+# Seconds between two message edits/posts in the same channel during a refresh
+REFRESH_INTERVAL = 1.5
+# Seconds between two progress reports of a refresh
+REFRESH_PROGRESS_INTERVAL = 10
 
 
 class EmbedController(commands.Cog, name='EmbedController'):
@@ -19,6 +27,20 @@ class EmbedController(commands.Cog, name='EmbedController'):
     async def cog_check(self, ctx):
         return self.client.user_is_admin(ctx.author)
 
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.author.id == self.client.user.id:
+            track_message(message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        forget_message(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            forget_message(message_id)
+
     async def validate_content(self, ctx):
         user_input = ctx.kwargs.get('user_input', None)
         if not user_input:
@@ -64,7 +86,7 @@ class EmbedController(commands.Cog, name='EmbedController'):
             channel = channel[0]
 
         try:
-            new_embed = self.EmbedDB.create_new(
+            new_embed = await self.EmbedDB.create_new(
                 user_id=ctx.author.id,
                 channel_id=channel.id if channel else None,
                 content=content,
@@ -90,7 +112,7 @@ class EmbedController(commands.Cog, name='EmbedController'):
     async def embed_post(self, ctx, embed_id, channel: TextChannel = None):
         """Post or repost an embed"""
         try:
-            embed = self.EmbedDB.query_one(id=embed_id)
+            embed = await self.EmbedDB.query_one(id=embed_id)
             message = await embed.post(channel.id if channel else None)
             await ctx.send('Embed Posted ' + message.jump_url)
         except (ModelError, DBError) as e:
@@ -104,10 +126,12 @@ class EmbedController(commands.Cog, name='EmbedController'):
         try:
             content = await self.validate_content(ctx)
 
-            embed = self.EmbedDB.query_one(id=embed_id)
-            embed.content = content
-            await ctx.send('Embed update successful - trying to update message')
-            message = await embed.update()
+            embed = await self.EmbedDB.query_one(id=embed_id)
+            # content and rendered_hash are written together
+            with embed.batch():
+                embed.content = content
+                await ctx.send('Embed update successful - trying to update message')
+                message = await embed.update()
             await ctx.send('Message update successful ' + message.jump_url)
         except (json.JSONDecodeError, DBError, ModelError) as e:
             await ctx.send(e)
@@ -119,7 +143,7 @@ class EmbedController(commands.Cog, name='EmbedController'):
     async def embed_print(self, ctx, embed_id: int):
         """Print the embeds content JSON Object"""
         try:
-            embed = self.EmbedDB.query_one(id=embed_id)
+            embed = await self.EmbedDB.query_one(id=embed_id)
 
             if not embed:
                 await ctx.send('Embed ID not found in Database')
@@ -143,7 +167,7 @@ class EmbedController(commands.Cog, name='EmbedController'):
     async def embed_delete(self, ctx, embed_ids: commands.Greedy[int]):
         statuses = []
         for embed_id in embed_ids:
-            embed = self.EmbedDB.query_one(id=embed_id)
+            embed = await self.EmbedDB.query_one(id=embed_id)
             if embed:
                 status = await embed.remove()
                 statuses.append(f'{embed_id}: ' + status)
@@ -154,7 +178,7 @@ class EmbedController(commands.Cog, name='EmbedController'):
         aliases=['active']
     )
     async def embed_list(self, ctx):
-        embeds = self.EmbedDB.query_all_filter(self.EmbedDB.table_class.message_id != 0)
+        embeds = await self.EmbedDB.query_all_filter(self.EmbedDB.table_class.message_id != 0)
         to_print = ['Active Embeds:']
 
         if not embeds:
@@ -163,18 +187,81 @@ class EmbedController(commands.Cog, name='EmbedController'):
 
         await ctx.trigger_typing()
 
-        for embed in embeds:
-            message = await embed.get_discord_message()
+        messages = await self.EmbedDB.get_discord_messages(embeds)
+        for embed, message in zip(embeds, messages):
             if not message:
                 to_print.append(f'{embed.id}: message not found in discord - db updated')
                 continue
             channel = message.channel
-            title = json.loads(embed.content).get('title', '')
+            title = embed.title or ''
             to_print.append(f'{embed.id}: {channel.mention} {title} <{message.jump_url}>')
 
         for i in range(0, len(to_print), 11):
             await ctx.send('\n'.join(to_print[i:i+11]))
 
+    @embed_base.command(
+        name='refresh',
+    )
+    async def embed_refresh(self, ctx, channel: TextChannel = None):
+        """Render all active embeds (of a channel) again and edit or repost their messages"""
+        table = self.EmbedDB.table_class
+        criterion = [table.message_id != 0]
+        if channel:
+            criterion.append(table.channel_id == channel.id)
+        embeds = await self.EmbedDB.query_all_filter(*criterion)
+        if not embeds:
+            await ctx.send('No active embeds found')
+            return
+
+        # One queue per channel - the channels are worked on in parallel, the requests
+        # inside a channel share a rate limit and are paced
+        queues = {}
+        for embed in embeds:
+            queues.setdefault(embed.channel_id, asyncio.Queue()).put_nowait(embed.id)
+
+        results = Counter()
+        failed = []
+
+        async def work(queue):
+            while not queue.empty():
+                embed_id = queue.get_nowait()
+                try:
+                    # Load the embed again, it may have been edited while the refresh was waiting
+                    embed = await self.EmbedDB.query_one(id=embed_id)
+                    if embed is None or not embed.message_id:
+                        status = 'skipped'
+                    else:
+                        status = await embed.refresh()
+                except (ModelError, DBError, discord_errors.HTTPException) as e:
+                    status = 'failed'
+                    failed.append(f'{embed_id}: {e}')
+                except Exception as e:  # pylint: disable=broad-except
+                    # One broken embed must not stop the queue of its channel
+                    status = 'failed'
+                    failed.append(f'{embed_id}: {type(e).__name__}: {e}')
+                    await self.client.log_error(e, 'EmbedController.embed_refresh')
+                results[status] += 1
+                if status not in ('unchanged', 'skipped'):
+                    await asyncio.sleep(REFRESH_INTERVAL)
+
+        def report():
+            counts = ', '.join(f'{status}: {count}' for status, count in sorted(results.items()))
+            return f'Refreshed {sum(results.values())}/{len(embeds)} embeds ({counts or "-"})'
+
+        progress = await ctx.send(f'Refreshing {len(embeds)} embeds in {len(queues)} channels')
+        workers = asyncio.gather(*(work(queue) for queue in queues.values()))
+        while True:
+            try:
+                await asyncio.wait_for(asyncio.shield(workers), timeout=REFRESH_PROGRESS_INTERVAL)
+                break
+            except asyncio.TimeoutError:
+                await progress.edit(content=report())
+
+        await progress.edit(content=report())
+        if failed:
+            for i in range(0, len(failed), 20):
+                await ctx.send('```\n' + '\n'.join(failed[i:i+20]) + '```')
+
     # @embed_base.command(
     #     name='search',
     #     aliases=['find'],
@@ -45,7 +45,7 @@ class QuestController(commands.Cog, name='QuestController'):
     ):
         """Add a quest"""
         try:
-            quest = self.QuestDB.create_new(
+            quest = await self.QuestDB.create_new(
                 quest_id=quest_id,
                 date=date,
                 multi=multi,
@@ -56,7 +56,7 @@ class QuestController(commands.Cog, name='QuestController'):
                 description=description,
             )
 
-            embed = self.EmbedDB.create_new(
+            embed = await self.EmbedDB.create_new(
                 user_id=None,
                 channel_id=None,
                 content=quest.create_embed_content(),
@@ -77,8 +77,8 @@ class QuestController(commands.Cog, name='QuestController'):
     async def quest_post(self, ctx, quest_id: int, channel: TextChannel = None):
         """Post a quest embed to a channel"""
         try:
-            quest = self.QuestDB.query_one(id=quest_id)
-            embed = self.EmbedDB.query_one(id=quest.embed_id)
+            quest = await self.QuestDB.query_one(id=quest_id)
+            embed = await self.EmbedDB.query_one(id=quest.embed_id)
             message = await embed.post(channel.id if channel else None)
             await ctx.send('Quest Posted ' + message.jump_url)
         except (ModelError, DBError) as e:
@@ -91,7 +91,7 @@ class QuestController(commands.Cog, name='QuestController'):
     async def quest_edit(self, ctx, quest_id: int, attribute: str, *, value: str):
         """Edit a quest"""
         value = value.replace('`', '')
-        quest = self.QuestDB.query_one(id=quest_id)
+        quest = await self.QuestDB.query_one(id=quest_id)
         await quest.edit(attribute, value)
         await ctx.send('Quest updated')
 
@@ -100,7 +100,7 @@ class QuestController(commands.Cog, name='QuestController'):
     )
     async def quest_show(self, ctx, quest_id):
         """Show the attributes of a quest"""
-        quest = self.QuestDB.query_one(id=quest_id)
+        quest = await self.QuestDB.query_one(id=quest_id)
 
         to_print = []
         to_print.append(f'**date:** `{quest.date}`')
@@ -118,7 +118,7 @@ class QuestController(commands.Cog, name='QuestController'):
     )
     async def quest_list(self, ctx):
         """List all quests"""
-        quests = self.QuestDB.query_all()
+        quests = await self.QuestDB.query_all()
 
         await ctx.send('```\n' + ', '.join(str(q.id) for q in quests) + '```')
 
@@ -127,7 +127,7 @@ class QuestController(commands.Cog, name='QuestController'):
     )
     async def quest_delete(self, ctx, quest_id):
         """Delete a quest"""
-        quest = self.QuestDB.query_one(id=quest_id)
+        quest = await self.QuestDB.query_one(id=quest_id)
         if quest:
             if await quest.delete() == 1:
                 await ctx.send(f'Quest {quest_id} deleted')
@@ -5,7 +5,7 @@ It will add commands to speak in character.
 from urllib.parse import urlparse
 from discord.ext import commands
 from discord import Embed, DMChannel, Member, Role
-from .models.core import DBError
+from .models.core import DBError, CharacterData
 from .models.character_model import CharacterDB, UserDB
 from .models.user_model import UserDB
 
@@ -29,12 +29,12 @@ class InChar(commands.Cog, name='InCharacter'):
     async def char_base(self, ctx, charname=None):
         """Add/Change Characters `+help char`"""
         user_id = ctx.author.id
-        user = self.UserDB.query_one(id=user_id)
+        user = await self.UserDB.query_one(id=user_id)
 
         if charname is None:
             user.active_char = None
         else:
-            char = self.CharacterDB.query_one(user_id=user_id, name=charname)
+            char = await self.CharacterDB.query_one(user_id=user_id, name=charname)
             if not char:
                 raise commands.BadArgument(f'Character {charname} not found')
             user.active_char = char.id
@@ -54,7 +54,7 @@ class InChar(commands.Cog, name='InCharacter'):
             raise commands.BadArgument('Please only use `' + ' '.join(valid_filetypes) + '`')
 
         try:
-            new_char = self.CharacterDB.create_new(
+            new_char = await self.CharacterDB.create_new(
                 user_id=ctx.author.id,
                 name=charname,
                 display_name=displayname,
@@ -94,7 +94,7 @@ class InChar(commands.Cog, name='InCharacter'):
                 raise commands.BadArgument('Please only use `' + ' '.join(valid_filetypes) + '`')
         if value.isdigit():
             value = int(value)
-        char = self.CharacterDB.query_one(user_id=ctx.author.id, name=char_name)
+        char = await self.CharacterDB.query_one(user_id=ctx.author.id, name=char_name)
         if not char:
             raise commands.BadArgument(f'No Character with name {char_name} found')
         await char.edit(attribute, value)
@@ -106,7 +106,7 @@ class InChar(commands.Cog, name='InCharacter'):
     )
     async def delete(self, ctx, charname):
         """Remove a character"""
-        char = self.CharacterDB.query_one(user_id=ctx.author.id, name=charname)
+        char = await self.CharacterDB.query_one(user_id=ctx.author.id, name=charname)
         if not char:
             raise commands.BadArgument('Character not found')
 
@@ -122,7 +122,7 @@ class InChar(commands.Cog, name='InCharacter'):
     async def admin_show_chars(self, ctx, target_user: Member):
         """Admin command to show all characters of a target user"""
         user_id = target_user.id
-        chars = self.CharacterDB.query_all(user_id=user_id)
+        chars = await self.CharacterDB.query_user_chars(user_id)
         if not chars:
             raise commands.BadArgument('No characters found')
 
@@ -137,11 +137,10 @@ class InChar(commands.Cog, name='InCharacter'):
     async def show_chars(self, ctx):
         """Show all your characters"""
         user_id = ctx.author.id
-        user = self.UserDB.query_one(id=user_id)
-        chars = self.CharacterDB.query_all(user_id=user_id)
+        chars = await self.CharacterDB.query_user_chars(user_id)
         if not chars:
             raise commands.BadArgument('No Characters found')
-        active_char = self.CharacterDB.query_one(id=user.active_char)
+        active_char = await self.CharacterDB.query_active_char(user_id)
 
         list_to_print = '\n'.join(c.name + ' (NPC)' * c.npc_status for c in chars)
         pic_url = ''
@@ -160,12 +159,11 @@ class InChar(commands.Cog, name='InCharacter'):
         """Show the attributes of a character"""
         user_id = ctx.author.id
         if charname is None:
-            user = self.UserDB.query_one(id=user_id)
-            if user is None or user.active_char is None:
+            char = await self.CharacterDB.query_active_char(user_id)
+            if char is None:
                 raise commands.BadArgument(f'No active character found')
-            char = self.CharacterDB.query_one(id=user.active_char)
         else:
-            char = self.CharacterDB.query_one(user_id=user_id, name=charname)
+            char = await self.CharacterDB.query_one(user_id=user_id, name=charname)
 
         if not char:
             raise commands.BadArgument(f'No character with name {charname} found')
@@ -195,26 +193,22 @@ class InChar(commands.Cog, name='InCharacter'):
     async def write_in_character(self, ctx, charname, *, user_input=''):
         """Write a message as a specific character"""
         user_id = ctx.author.id
-        user = self.UserDB.query_one(id=user_id)
-        chars = self.CharacterDB.query_all(user_id=user_id)
-        if not user or not chars:
+        user = await self.UserDB.query_one(id=user_id)
+        name_index = await self.CharacterDB.query_name_index(user_id)
+        if not user or not name_index.characters:
             return
 
-        selected_char = None
-        for character in chars:
-            if character.name.lower().startswith(charname.lower()):
-                selected_char = character.id
-                break
+        # An exact name wins, otherwise the first matching name in alphabetical order
+        selected_char = name_index.find(charname)
         if selected_char is None:
             # If no char is selected here - try to select the active char
             if user.active_char is None:
                 return
-            selected_char = user.active_char
+            selected_char = await self.CharacterDB.query_one(id=user.active_char)
             # If the first word was not a char name it was part of the message
             # and should be reattached to the user input
             user_input = charname + ' ' + user_input
 
-        selected_char = self.CharacterDB.query_one(id=selected_char)
         if not selected_char:
             return
 
@@ -260,12 +254,13 @@ class InChar(commands.Cog, name='InCharacter'):
     async def set_rank(self, ctx, char_ids: commands.Greedy[int], rank: Role = None):
         """Set the rank of a list of characters"""
         res = []
+        chars = await self.CharacterDB.query_all_filter(CharacterData.id.in_(char_ids)) or ()
+        found = {char.id for char in chars}
+        await self.CharacterDB.bulk_update(chars, rank=rank.id)
         for char_id in char_ids:
-            char = self.CharacterDB.query_one(id=char_id)
-            if not char:
+            if char_id not in found:
                 res.append(f'Character {char_id} not found')
                 continue
-            char.rank = rank.id
             res.append(f'Rank of character {char_id} set to {rank.name}')
         await ctx.send('```\n' + '\n'.join(res) + '\n```')
 
@@ -276,12 +271,13 @@ class InChar(commands.Cog, name='InCharacter'):
     async def set_npc(self, ctx, char_ids: commands.Greedy[int], npc_status: bool):
         """Set the npc_status of a list of characters"""
         res = []
+        chars = await self.CharacterDB.query_all_filter(CharacterData.id.in_(char_ids)) or ()
+        found = {char.id for char in chars}
+        await self.CharacterDB.bulk_update(chars, npc_status=npc_status)
         for char_id in char_ids:
-            char = self.CharacterDB.query_one(id=char_id)
-            if not char:
+            if char_id not in found:
                 res.append(f'Character {char_id} not found')
                 continue
-            char.npc_status = npc_status
             res.append(f'NPC status of character {char_id} set to {npc_status}')
         await ctx.send('```\n' + '\n'.join(res) + '\n```')
 
@@ -1,25 +1,134 @@
 # pylint: disable=E0402, E0211, E1101
-from .core import DBError, BaseDB, BaseModel, CharacterData
-from .user_model import UserDB
+from bisect import bisect_left
+from sqlalchemy import or_
+from .core import DBError, ModelCache, BaseDB, BaseModel, CharacterData, UserData
+from .user_model import USER_CACHE, UserDB
+
+CHARACTER_CACHE = ModelCache()
+USER_CHARACTERS_CACHE = ModelCache()
 
 
 class CharacterDB(BaseDB):
+    cache = CHARACTER_CACHE
+
     def __init__(self, client):
         super().__init__(client, model_class=Character)
         self.UserDB = UserDB(client)
 
-    def query_active_char(self, user_id):
-        user = self.UserDB.query_one(id=user_id)
-        if not user.active_char:
+    async def query_one(self, **query_kwargs):
+        if query_kwargs.keys() == {'id'}:
+            character = CHARACTER_CACHE.get(query_kwargs['id'])
+            if character is not None:
+                return character
+        return await super().query_one(**query_kwargs)
+
+    def _query_one(self, **query_kwargs):
+        if query_kwargs.keys() == {'id'}:
+            character = CHARACTER_CACHE.get(query_kwargs['id'])
+            if character is not None:
+                return character
+        with self.client.state.get_session() as session:
+            data = session.query(self.table_class).filter_by(**query_kwargs).one_or_none()
+        if data is None:
             return None
-        character = self.query_one(id=user.active_char)
-        if not character:
-            user.active_char = None
+        return self._from_cache(data)
+
+    async def query_many(self, char_ids):
+        """Get a dict of characters by id - cache misses are loaded with a single IN query"""
+        chars = {}
+        missing = []
+        for char_id in char_ids:
+            character = CHARACTER_CACHE.get(char_id)
+            if character is None:
+                missing.append(char_id)
+            else:
+                chars[char_id] = character
+        if missing:
+            chars.update(await self.client.state.run(self._query_many, missing))
+        return chars
+
+    def _query_many(self, char_ids):
+        with self.client.state.get_session() as session:
+            data = session.query(self.table_class).filter(self.table_class.id.in_(char_ids)).all()
+        return {d.id: self._from_cache(d) for d in data}
+
+    async def query_user_chars(self, user_id):
+        """All characters of a user ordered by id, served from the cache when possible"""
+        name_index = await self.query_name_index(user_id)
+        return name_index.characters
+
+    async def query_name_index(self, user_id):
+        """The CharacterNameIndex of a user, served from the cache when possible"""
+        name_index = USER_CHARACTERS_CACHE.get(user_id)
+        if name_index is not None:
+            return name_index
+        return await self.client.state.run(self._query_name_index, user_id)
+
+    def _query_name_index(self, user_id):
+        with self.client.state.get_session() as session:
+            data = (
+                session.query(self.table_class)
+                .filter_by(user_id=user_id)
+                .order_by(self.table_class.id)
+                .all()
+            )
+        name_index = CharacterNameIndex(self._from_cache(d) for d in data)
+        USER_CHARACTERS_CACHE.set(user_id, name_index)
+        return name_index
+
+    async def query_account_holders(self):
+        """All characters that hold a bank account (no NPCs, except the bank itself)
+
+        Loaded with one query and ordered by user_id and id."""
+        return await self.client.state.run(self._query_account_holders)
+
+    def _query_account_holders(self):
+        with self.client.state.get_session() as session:
+            data = (
+                session.query(self.table_class)
+                .filter(or_(self.table_class.id == 1, ~self.table_class.npc_status))
+                .order_by(self.table_class.user_id, self.table_class.id)
+                .all()
+            )
+        return [self._from_cache(d) for d in data]
 
+    async def query_active_char(self, user_id):
+        _, character = await self.query_user_and_active_char(user_id)
         return character
 
-    def create_new(self, user_id, name, display_name, picture_url, npc_status, rank=None, level=None):
-        user = self.UserDB.query_one(id=user_id)
+    async def query_user_and_active_char(self, user_id):
+        """Get the user (created if needed) and its active character (or None) in one query"""
+        user = USER_CACHE.get(user_id)
+        if user is not None:
+            if not user.active_char:
+                return user, None
+            character = CHARACTER_CACHE.get(user.active_char)
+            if character is not None:
+                return user, character
+        return await self.client.state.run(self._query_user_and_active_char, user_id)
+
+    def _query_user_and_active_char(self, user_id):
+        with self.client.state.get_session() as session:
+            row = (
+                session.query(UserData, CharacterData)
+                .outerjoin(CharacterData, CharacterData.id == UserData.active_char)
+                .filter(UserData.id == user_id)
+                .one_or_none()
+            )
+        if row is None:
+            return self.UserDB._create_new(user_id), None
+
+        user_data, character_data = row
+        user = self.UserDB._from_cache(user_data)
+        if character_data is None:
+            if user.active_char:
+                user.active_char = None
+            return user, None
+
+        return user, self._from_cache(character_data)
+
+    def _create_new(self, user_id, name, display_name, picture_url, npc_status, rank=None, level=None):
+        user = self.UserDB._query_one(id=user_id)
 
         with self.client.state.get_session() as session:
             if session.query(CharacterData).filter_by(user_id=user_id, name=name).count() > 0:
@@ -38,7 +147,34 @@ class CharacterDB(BaseDB):
         with self.client.state.get_session() as session:
             session.add(data)
 
-        return self.model_class(self.client, data)
+        USER_CHARACTERS_CACHE.invalidate(user.id)
+        return self._from_cache(data)
+
+
+class CharacterNameIndex:
+    """The characters of one user sorted by lowercase name for prefix lookups"""
+    def __init__(self, characters):
+        self.characters = tuple(characters)
+        self._sorted = sorted(self.characters, key=lambda c: (c.name.lower(), c.id))
+        self._keys = [(c.name.lower(), c.id) for c in self._sorted]
+
+    def _start(self, prefix):
+        return bisect_left(self._keys, (prefix.lower(),))
+
+    def matches(self, prefix):
+        """All characters whose name starts with prefix (case insensitive) in name order"""
+        prefix = prefix.lower()
+        end = bisect_left(self._keys, (prefix + chr(0x10FFFF),))
+        return tuple(self._sorted[self._start(prefix):end])
+
+    def find(self, prefix):
+        """The character with this exact name, otherwise the first prefix match in name order
+
+        An exact name always sorts before every longer name sharing the prefix."""
+        start = self._start(prefix)
+        if start < len(self._keys) and self._keys[start][0].startswith(prefix.lower()):
+            return self._sorted[start]
+        return None
 
 
 class Character(BaseModel):
@@ -47,13 +183,28 @@ class Character(BaseModel):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def invalidate_cache(self):
+        if CHARACTER_CACHE.get(self.id) is not self:
+            CHARACTER_CACHE.invalidate(self.id)
+        # The index can outlive the CHARACTER_CACHE entry of its characters and hold
+        # other instances than the one that was written, so it's always rebuilt
+        USER_CHARACTERS_CACHE.invalidate(self.user_id)
+
+    async def delete(self):
+        status = await super().delete()
+        CHARACTER_CACHE.invalidate(self.id)
+        USER_CHARACTERS_CACHE.invalidate(self.user_id)
+        return status
+
     @property
     def user_id(self):
         return self.data.user_id
 
     @user_id.setter
     def user_id(self, value):
+        USER_CHARACTERS_CACHE.invalidate(self.data.user_id)
         self.data.user_id = int(value)
+        USER_CHARACTERS_CACHE.invalidate(self.data.user_id)
         self.save_to_db()
 
     @property
@@ -1,8 +1,15 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from sqlalchemy import create_engine
-from sqlalchemy import Column, Integer, String, Boolean
+from functools import partial
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy import Column, Integer, String, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm.exc import NoResultFound
 
 #pylint: disable=E1101
@@ -17,31 +24,102 @@ class ModelError(Exception):
     pass
 
 
+class ModelCache:
+    """Process-wide LRU cache for models whose entries expire after ttl seconds
+
+    It is shared by the event loop and the DB thread, so every access holds a lock."""
+    def __init__(self, max_size=2048, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class BaseDB:
+    """Data access for one table
+
+    The public methods are coroutines that run the blocking query code (the methods with a
+    leading underscore) on the DBConnector thread. Code that already runs on that thread has
+    to call the underscore methods directly."""
+    # ModelCache of the models by id, None if the models of this table aren't cached
+    cache = None
+
     def __init__(self, client, model_class):
         self.client = client
         self.model_class = model_class
         self.table_class = self.model_class.table_type
 
-    def query_one(self, **query_kwargs):
+    async def query_one(self, **query_kwargs):
+        return await self.client.state.run(self._query_one, **query_kwargs)
+
+    async def query_one_filter(self, *criterion):
+        return await self.client.state.run(self._query_one_filter, *criterion)
+
+    async def query_all(self, **query_kwargs):
+        return await self.client.state.run(self._query_all, **query_kwargs)
+
+    async def query_all_filter(self, *criterion):
+        return await self.client.state.run(self._query_all_filter, *criterion)
+
+    async def create_new(self, *args, **kwargs):
+        return await self.client.state.run(self._create_new, *args, **kwargs)
+
+    async def bulk_update(self, models, **fields):
+        """Set the same attributes on several models and write all of them with one commit"""
+        for model in models:
+            with model.deferred_save():
+                for attribute, value in fields.items():
+                    setattr(model, attribute, value)
+        rows = [row for row in (model._snapshot() for model in models) if row[1]]
+        if rows:
+            await self.client.state.run(self._write_rows, rows)
+
+    def _query_one(self, **query_kwargs):
         with self.client.state.get_session() as session:
             try:
                 data = session.query(self.table_class).filter_by(**query_kwargs).one()
             except NoResultFound:
                 return None
 
-        return self.model_class(self.client, data)
+        return self._from_cache(data)
 
-    def query_one_filter(self, *criterion):
+    def _query_one_filter(self, *criterion):
         with self.client.state.get_session() as session:
             try:
                 data = session.query(self.table_class).filter_by(*criterion).one()
             except NoResultFound:
                 return None
 
-        return self.model_class(self.client, data)
+        return self._from_cache(data)
 
-    def query_all(self, **query_kwargs):
+    def _query_all(self, **query_kwargs):
         with self.client.state.get_session() as session:
             try:
                 data = session.query(self.table_class).filter_by(**query_kwargs).all()
@@ -50,9 +128,9 @@ class BaseDB:
         if len(data) == 0:
             return None
         else:
-            return tuple(self.model_class(self.client, d) for d in data)
+            return tuple(self._from_cache(d) for d in data)
 
-    def query_all_filter(self, *criterion):
+    def _query_all_filter(self, *criterion):
         with self.client.state.get_session() as session:
             try:
                 data = session.query(self.table_class).filter(*criterion).all()
@@ -61,22 +139,116 @@ class BaseDB:
         if len(data) == 0:
             return None
         else:
-            return tuple(self.model_class(self.client, d) for d in data)
+            return tuple(self._from_cache(d) for d in data)
 
-    def create_new(self):
+    def _create_new(self):
         pass
 
+    def _from_cache(self, data):
+        """Return the cached model for a row so all readers share one up to date instance"""
+        if self.cache is None:
+            return self.model_class(self.client, data)
+        model = self.cache.get(data.id)
+        if model is None:
+            model = self.model_class(self.client, data)
+            self.cache.set(model.id, model)
+        return model
+
+    def _write_rows(self, rows):
+        with self.client.state.get_session() as session:
+            for row_id, values in rows:
+                session.query(self.table_class).filter_by(id=row_id).update(
+                    values, synchronize_session=False
+                )
+
 
 class BaseModel:
     def __init__(self, client, data):
         self.client = client
         self.data = data
+        self._deferred = 0
+        self._dirty = False
+        self._saved = self._column_values()
 
     def save_to_db(self):
+        """Queue a write of the changed attribute values on the DB thread
+
+        Returns an awaitable for the write, or None if it was deferred, already done or
+        nothing changed"""
+        if self._deferred:
+            self._dirty = True
+            return None
+        row_id, values = self._snapshot()
+        if not values:
+            return None
+        future = self.client.state.run_soon(self._write_row, row_id, values)
+        if future is not None:
+            future.add_done_callback(self._report_write_error)
+        return future
+
+    def invalidate_cache(self):
+        """Called whenever the model is written - cached models drop stale cache entries here"""
+        pass
+
+    def _column_values(self):
+        return {attr.key: getattr(self.data, attr.key) for attr in inspect(self.table_type).column_attrs}
+
+    def _snapshot(self):
+        """Copy the columns changed since the last write so the DB thread never touches the data object
+
+        Unchanged columns are left out, otherwise a stale model of the same row would overwrite
+        the changes made through another one"""
+        self.invalidate_cache()
+        values = self._column_values()
+        changed = {key: value for key, value in values.items() if value != self._saved[key]}
+        row_id = self._saved['id']
+        self._saved = values
+        self._dirty = False
+        return row_id, changed
+
+    def _write_row(self, row_id, values):
         with self.client.state.get_session() as session:
-            session.add(self.data)
+            session.query(self.table_type).filter_by(id=row_id).update(
+                values, synchronize_session=False
+            )
+
+    def _report_write_error(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        asyncio.ensure_future(
+            self.client.log_error(future.exception(), f'{type(self).__name__}.save_to_db')
+        )
+
+    @contextmanager
+    def deferred_save(self):
+        """Only mark the model as changed instead of writing it on every attribute change"""
+        self._deferred += 1
+        try:
+            yield self
+        finally:
+            self._deferred -= 1
+
+    @contextmanager
+    def batch(self):
+        """Collect the attribute changes made inside the block and write them with one commit
+
+        The changes are written even if the block raises, they already happened in memory"""
+        try:
+            with self.deferred_save():
+                yield self
+        finally:
+            if not self._deferred and self._dirty:
+                self.save_to_db()
+
+    def bulk_update(self, **fields):
+        with self.batch():
+            for attribute, value in fields.items():
+                setattr(self, attribute, value)
 
     async def delete(self):
+        return await self.client.state.run(self._delete)
+
+    def _delete(self):
         with self.client.state.get_session() as session:
             status = session.query(type(self).table_type).filter_by(id=self.id).delete()
         return status
@@ -106,6 +278,9 @@ class UserData(Base):
 
 class CharacterData(Base):
     __tablename__ = 'characters'
+    __table_args__ = (
+        Index('ix_characters_user_id_name', 'user_id', 'name'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, nullable=False)
@@ -122,14 +297,17 @@ class CharacterData(Base):
 
 class TransactionData(Base):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        Index('ix_transactions_receiver_id_confirmed', 'receiver_id', 'confirmed'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     date = Column(String, nullable=False)
     user_id = Column(Integer, nullable=False)
-    receiver_id = Column(Integer, nullable=False)
+    receiver_id = Column(Integer, nullable=False, index=True)
     sender_id = Column(Integer)
     description = Column(String)
-    confirmed = Column(Boolean)
+    confirmed = Column(Boolean, index=True)
     platinum = Column(Integer)
     electrum = Column(Integer)
     gold = Column(Integer)
@@ -141,6 +319,34 @@ class TransactionData(Base):
     #     return f'<TransactionData({self.id=}, {self.user_id=}, {self.description=}, {self.date=}, {self.platinum=}, {self.electrum=}, {self.gold=}, {self.silver=}, {self.copper=})>'
 
 
+class AccountBalanceData(Base):
+    __tablename__ = 'account_balances'
+
+    account_id = Column(Integer, primary_key=True, autoincrement=False)
+    platinum = Column(Integer, nullable=False, server_default='0')
+    electrum = Column(Integer, nullable=False, server_default='0')
+    gold = Column(Integer, nullable=False, server_default='0')
+    silver = Column(Integer, nullable=False, server_default='0')
+    copper = Column(Integer, nullable=False, server_default='0')
+
+
+class AccountCheckpointData(Base):
+    __tablename__ = 'account_checkpoints'
+    __table_args__ = (
+        Index('ix_account_checkpoints_account_id_transaction_id', 'account_id', 'transaction_id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    account_id = Column(Integer, nullable=False)
+    transaction_id = Column(Integer, nullable=False)
+    date = Column(String, nullable=False)
+    platinum = Column(Integer, nullable=False)
+    electrum = Column(Integer, nullable=False)
+    gold = Column(Integer, nullable=False)
+    silver = Column(Integer, nullable=False)
+    copper = Column(Integer, nullable=False)
+
+
 class EmbedData(Base):
     __tablename__ = 'embeds'
 
@@ -149,7 +355,11 @@ class EmbedData(Base):
     date = Column(String, nullable=False)
     user_id = Column(Integer)
     channel_id = Column(Integer)
-    message_id = Column(Integer)
+    message_id = Column(Integer, index=True)
+    # Copy of the title in content, so listings don't have to parse the JSON
+    title = Column(String)
+    # Hash of the embed as it was last sent to discord
+    rendered_hash = Column(String)
 
     # def __repr__(self):
     #     return f'<EmbedData({self.id=}, {self.user_id=}, {self.channel_id=}, {self.message_id=}, {self.content=}, {self.date=})>'
@@ -177,18 +387,232 @@ class QuestToCharacter(Base):
     __tablename__ = 'quest_to_character'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    quest_id = Column(Integer, nullable=False)
-    character_id = Column(Integer, nullable=False)
+    quest_id = Column(Integer, nullable=False, index=True)
+    character_id = Column(Integer, nullable=False, index=True)
 
     # def __repr__(self):
     #     return f'<QuestToCharacter({self.id=}, {self.quest_id=}, {self.character_id=})>'
 
 
+COIN_COLUMNS = ('platinum', 'electrum', 'gold', 'silver', 'copper')
+
+
+def _balance_change(sign, row):
+    return ', '.join(f'{c} = {c} {sign} COALESCE({row}.{c}, 0)' for c in COIN_COLUMNS)
+
+
+# The triggers keep account_balances in sync with every write to confirmed
+# transactions, inside the same database transaction as the write itself.
+BALANCE_TRIGGERS = (
+    f'''CREATE TRIGGER IF NOT EXISTS transactions_balance_insert
+    AFTER INSERT ON transactions WHEN NEW.confirmed
+    BEGIN
+        INSERT OR IGNORE INTO account_balances (account_id) VALUES (NEW.receiver_id);
+        UPDATE account_balances SET {_balance_change('+', 'NEW')}
+        WHERE account_id = NEW.receiver_id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS transactions_balance_delete
+    AFTER DELETE ON transactions WHEN OLD.confirmed
+    BEGIN
+        UPDATE account_balances SET {_balance_change('-', 'OLD')}
+        WHERE account_id = OLD.receiver_id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS transactions_balance_update
+    AFTER UPDATE OF receiver_id, confirmed, {', '.join(COIN_COLUMNS)} ON transactions
+    BEGIN
+        UPDATE account_balances SET {_balance_change('-', 'OLD')}
+        WHERE account_id = OLD.receiver_id AND OLD.confirmed;
+        INSERT OR IGNORE INTO account_balances (account_id)
+        SELECT NEW.receiver_id WHERE NEW.confirmed;
+        UPDATE account_balances SET {_balance_change('+', 'NEW')}
+        WHERE account_id = NEW.receiver_id AND NEW.confirmed;
+    END''',
+)
+
+# A checkpoint holds the confirmed balance of an account up to transaction_id. Any change to a
+# transaction at or below that id makes the checkpoint wrong, so it is dropped right away
+CHECKPOINT_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS transactions_checkpoint_insert
+    AFTER INSERT ON transactions
+    BEGIN
+        DELETE FROM account_checkpoints
+        WHERE account_id = NEW.receiver_id AND transaction_id >= NEW.id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS transactions_checkpoint_delete
+    AFTER DELETE ON transactions
+    BEGIN
+        DELETE FROM account_checkpoints
+        WHERE account_id = OLD.receiver_id AND transaction_id >= OLD.id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS transactions_checkpoint_update
+    AFTER UPDATE ON transactions
+    WHEN OLD.id IS NOT NEW.id OR OLD.receiver_id IS NOT NEW.receiver_id
+        OR OLD.confirmed IS NOT NEW.confirmed
+        OR {' OR '.join(f'OLD.{c} IS NOT NEW.{c}' for c in COIN_COLUMNS)}
+    BEGIN
+        DELETE FROM account_checkpoints
+        WHERE account_id IN (OLD.receiver_id, NEW.receiver_id)
+        AND transaction_id >= MIN(OLD.id, NEW.id);
+    END''',
+)
+
+REBUILD_BALANCES = (
+    'DELETE FROM account_balances',
+    f'''INSERT INTO account_balances (account_id, {', '.join(COIN_COLUMNS)})
+    SELECT receiver_id, {', '.join(f'SUM(COALESCE({c}, 0))' for c in COIN_COLUMNS)}
+    FROM transactions WHERE confirmed GROUP BY receiver_id''',
+)
+
+
+# External content FTS5 index over transactions.description, kept in sync by triggers
+TRANSACTIONS_FTS = (
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts
+    USING fts5(description, content='transactions', content_rowid='id')''',
+    '''CREATE TRIGGER IF NOT EXISTS transactions_fts_insert
+    AFTER INSERT ON transactions
+    BEGIN
+        INSERT INTO transactions_fts (rowid, description) VALUES (NEW.id, NEW.description);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS transactions_fts_delete
+    AFTER DELETE ON transactions
+    BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, description)
+        VALUES ('delete', OLD.id, OLD.description);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS transactions_fts_update
+    AFTER UPDATE OF id, description ON transactions
+    BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, description)
+        VALUES ('delete', OLD.id, OLD.description);
+        INSERT INTO transactions_fts (rowid, description) VALUES (NEW.id, NEW.description);
+    END''',
+)
+
+REBUILD_TRANSACTIONS_FTS = "INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')"
+
+
+# Statements that fill a column right after it was added to an existing table
+COLUMN_BACKFILLS = {
+    ('embeds', 'title'): '''UPDATE embeds SET title = CASE
+        WHEN json_type(content, '$.embed') IS NOT NULL THEN json_extract(content, '$.embed.title')
+        WHEN json_type(content, '$.embeds') IS NOT NULL THEN json_extract(content, '$.embeds[0].title')
+        ELSE json_extract(content, '$.title') END
+    WHERE json_valid(content)''',
+}
+
+
+# Connection profile applied to every new SQLite connection, can be overridden in the config.
+# WAL lets readers run while a write is in progress, NORMAL only syncs at checkpoints in WAL mode
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -16000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+
 class DBConnector():
-    def __init__(self, db_path):
+    def __init__(self, db_path, pragmas=None):
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
         self.engine = create_engine(db_path)
+        event.listen(self.engine, 'connect', self.apply_pragmas)
         self.session_maker = sessionmaker(self.engine, expire_on_commit=False)
+        balances_existed = inspect(self.engine).has_table(AccountBalanceData.__tablename__)
         Base.metadata.create_all(self.engine)
+        self.backfill_columns(self.create_missing_columns())
+        self.create_missing_indexes()
+        with self.engine.begin() as connection:
+            for statement in BALANCE_TRIGGERS + CHECKPOINT_TRIGGERS:
+                connection.execute(text(statement))
+            if not balances_existed:
+                for statement in REBUILD_BALANCES:
+                    connection.execute(text(statement))
+        self.full_text_search = self.create_full_text_search()
+        # A single worker keeps blocking SQLite calls off the event loop
+        # and applies queued writes in the order they were made
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+    async def run(self, func, *args, **kwargs):
+        """Run blocking database code on the DB thread and wait for its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def run_soon(self, func, *args, **kwargs):
+        """Queue blocking database code on the DB thread without waiting for it
+
+        Outside of the event loop (e.g. on the DB thread itself) the code runs right away"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            func(*args, **kwargs)
+            return None
+        return loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.engine.dispose()
+
+    def apply_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in self.pragmas.items():
+            if value is None:
+                continue
+            if not name.isidentifier():
+                raise DBError(f'Invalid pragma name {name}')
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    def create_missing_columns(self):
+        """create_all skips tables that already exist - add columns declared later to them
+
+        Returns the (table, column) names that were added"""
+        inspector = inspect(self.engine)
+        added = []
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    connection.execute(text(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                    ))
+                    added.append((table.name, column.name))
+        return added
+
+    def backfill_columns(self, columns):
+        """Fill freshly added columns, skipped if SQLite can't run the statement (no JSON1)"""
+        for column in columns:
+            statement = COLUMN_BACKFILLS.get(column)
+            if statement is None:
+                continue
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(text(statement))
+            except OperationalError:
+                pass
+
+    def create_missing_indexes(self):
+        """create_all skips tables that already exist - add indexes declared later to them"""
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
+
+    def create_full_text_search(self):
+        """Set up the transactions_fts index, returns False if SQLite was built without FTS5"""
+        fts_existed = inspect(self.engine).has_table('transactions_fts')
+        try:
+            with self.engine.begin() as connection:
+                for statement in TRANSACTIONS_FTS:
+                    connection.execute(text(statement))
+                if not fts_existed:
+                    connection.execute(text(REBUILD_TRANSACTIONS_FTS))
+        except OperationalError:
+            return False
+        return True
 
     @contextmanager
     def get_session(self):
@@ -1,20 +1,96 @@
 # pylint: disable=E0402, E0211, E1101
+import asyncio
+import hashlib
 import json
 from discord import Embed as DiscordEmbed
-from .core import ModelError, BaseDB, BaseModel, EmbedData
+from discord import errors as discord_errors
+from .core import ModelError, ModelCache, BaseDB, BaseModel, EmbedData
+
+# Messages that are fetched at the same time, discord.py queues requests per rate limit bucket
+MESSAGE_FETCH_CONCURRENCY = 5
+# (parsed content, discord embed without footer) by content hash, shared by all Embeds
+PARSED_EMBED_CACHE = ModelCache(max_size=512)
+
+# Messages posted by the bot by id, kept up to date by the EmbedController listeners
+TRACKED_MESSAGES = ModelCache(max_size=4096, ttl=24 * 60 * 60)
+
+
+def track_message(message):
+    TRACKED_MESSAGES.set(message.id, message)
+
+
+def forget_message(message_id):
+    TRACKED_MESSAGES.invalidate(message_id)
+
+
+def find_cached_message(message_id, known_messages=None):
+    """Look a message up in the tracked messages and a dict of known messages (no API call)"""
+    message = TRACKED_MESSAGES.get(message_id)
+    if message is None and known_messages:
+        message = known_messages.get(message_id)
+    return message
+
+
+def content_key(content):
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def rendered_key(embed):
+    """Stable hash of a discord Embed as it would be sent"""
+    return hashlib.sha1(json.dumps(embed.to_dict(), sort_keys=True).encode()).hexdigest()
+
+
+def parse_content(content):
+    """Parse a content JSON string and return the dict describing the embed"""
+    content = json.loads(content)
+
+    if 'embed' in content:
+        content = content['embed']
+    elif 'embeds' in content:
+        content = content['embeds'][0]
+
+    return content
+
+
+def build_discord_embed(content):
+    """Build a discord Embed from parsed content (without the footer)"""
+    embed = DiscordEmbed(
+        title=content.get('title', None),
+        description=content.get('description', None),
+        url=content.get('url', None),
+        color=content.get('color', None) or 0x4f545c,
+    )
+
+    for field in content.get('fields', []):
+        embed.add_field(
+            name=field['name'],
+            value=field['value'],
+            inline=field.get('inline', False),
+        )
+
+    author = content.get('author', None)
+    if author:
+        embed.set_author(
+            name=author.get('name', None),
+            url=author.get('url', DiscordEmbed.Empty),
+            icon_url=author.get('icon_url', DiscordEmbed.Empty),
+        )
+
+    return embed
 
 
 class EmbedDB(BaseDB):
     def __init__(self, client):
         super().__init__(client, model_class=Embed)
 
-    def create_new(self, content, date, user_id=None, channel_id=None, message_id=None):
+    def _create_new(self, content, date, user_id=None, channel_id=None, message_id=None):
         data = EmbedData(
             content=content,
             date=date,
             user_id=user_id,
             channel_id=channel_id,
             message_id=message_id,
+            title=parse_content(content).get('title', None),
         )
 
         with self.client.state.get_session() as session:
@@ -22,6 +98,34 @@ class EmbedDB(BaseDB):
 
         return self.model_class(self.client, data)
 
+    async def get_discord_messages(self, embeds, clear_missing=True):
+        """Fetch the discord messages of several embeds concurrently
+
+        Returns the messages (None if not found) in the order of embeds. The message_id of the
+        embeds whose message is gone is cleared with a single write."""
+        semaphore = asyncio.Semaphore(MESSAGE_FETCH_CONCURRENCY)
+        # After a restart few messages are tracked - index the client's message cache once
+        # for the whole batch instead of searching it for every embed
+        known_messages = None
+        if any(embed.message_id and TRACKED_MESSAGES.get(embed.message_id) is None for embed in embeds):
+            known_messages = {message.id: message for message in self.client.cached_messages}
+
+        async def fetch(embed):
+            async with semaphore:
+                return await embed.get_discord_message(
+                    clear_missing=False, known_messages=known_messages
+                )
+
+        messages = await asyncio.gather(*(fetch(embed) for embed in embeds))
+        if clear_missing:
+            missing = [
+                embed for embed, message in zip(embeds, messages)
+                if message is None and embed.message_id
+            ]
+            if missing:
+                await self.bulk_update(missing, message_id=None)
+        return messages
+
 
 class Embed(BaseModel):
     table_type = EmbedData
@@ -35,7 +139,25 @@ class Embed(BaseModel):
 
     @content.setter
     def content(self, value):
+        PARSED_EMBED_CACHE.invalidate(content_key(self.data.content))
         self.data.content = str(value)
+        self.data.title = self.parsed_content().get('title', None)
+        self.save_to_db()
+
+    @property
+    def title(self):
+        if self.data.title is None:
+            # Rows that could not be backfilled when the column was added
+            return self.parsed_content().get('title', None)
+        return self.data.title
+
+    @property
+    def rendered_hash(self):
+        return self.data.rendered_hash
+
+    @rendered_hash.setter
+    def rendered_hash(self, value):
+        self.data.rendered_hash = value
         self.save_to_db()
 
     @property
@@ -75,35 +197,44 @@ class Embed(BaseModel):
         self.save_to_db()
 
 
-    async def get_discord_message(self):
+    async def get_discord_message(self, clear_missing=True, known_messages=None):
         if not self.message_id or not self.channel_id:
             return None
+        message = find_cached_message(self.message_id, known_messages)
+        if message is not None:
+            track_message(message)
+            return message
         try:
             channel = self.client.get_channel(self.channel_id)
             message = await channel.fetch_message(self.message_id)
+            track_message(message)
             return message
         except Exception:
-            self.message_id = None
+            if clear_missing:
+                self.message_id = None
             return None
 
     async def post(self, channel_id=None):
-        if channel_id:
-            self.channel_id = channel_id
+        with self.batch():
+            if channel_id:
+                self.channel_id = channel_id
 
-        if not self.channel_id:
-            raise ModelError('Error posting Embed - no channel assigned yet')
+            if not self.channel_id:
+                raise ModelError('Error posting Embed - no channel assigned yet')
 
-        if self.message_id:
-            await self.remove()
+            if self.message_id:
+                await self.remove()
 
-        channel = self.client.get_channel(self.channel_id)
-        if not channel:
-            raise ModelError('Error posting Embed - channel does not exist')
+            channel = self.client.get_channel(self.channel_id)
+            if not channel:
+                raise ModelError('Error posting Embed - channel does not exist')
 
-        embed = self.construct_discord_embed()
+            embed = self.construct_discord_embed()
 
-        message = await channel.send(embed=embed)
-        self.message_id = message.id
+            message = await channel.send(embed=embed)
+            track_message(message)
+            self.message_id = message.id
+            self.rendered_hash = rendered_key(embed)
 
         return message
 
@@ -111,7 +242,11 @@ class Embed(BaseModel):
         status = 'Message not found'
         message = await self.get_discord_message()
         if message:
-            await message.delete()
+            try:
+                await message.delete()
+            except discord_errors.NotFound:
+                pass
+            forget_message(message.id)
             status = 'Message deleted'
         self.message_id = None
 
@@ -119,52 +254,68 @@ class Embed(BaseModel):
 
     async def delete(self):
         await self.remove()
-        with self.client.state.get_session() as session:
-            status = session.query(type(self).table_type).filter_by(id=self.id).delete()
-        return status
+        return await super().delete()
 
     async def update(self):
         message = await self.get_discord_message()
         if not message:
             raise ModelError('Error updating Message - Message containing embed not found.')
 
-        await message.edit(embed=self.construct_discord_embed())
-        return message
+        embed = self.construct_discord_embed()
+        rendered_hash = rendered_key(embed)
+        # Nothing that is displayed changed - save the edit request
+        if rendered_hash == self.rendered_hash:
+            return message
 
-    def construct_discord_embed(self):
-        content = json.loads(self.content)
+        try:
+            await message.edit(embed=embed)
+        except discord_errors.NotFound:
+            # The cached message was deleted while no delete event reached the bot
+            forget_message(message.id)
+            self.message_id = None
+            raise ModelError('Error updating Message - Message containing embed not found.')
+        self.rendered_hash = rendered_hash
+        return message
 
-        if 'embed' in content:
-            content = content['embed']
-        elif 'embeds' in content:
-            content = content['embeds'][0]
+    async def refresh(self):
+        """Render the embed again and edit its message, or post it again if the message is gone
 
-        user = self.client.get_user(self.user_id) if self.user_id else None
+        Returns 'unchanged', 'updated' or 'reposted'"""
+        message = await self.get_discord_message()
+        if message is not None:
+            old_hash = self.rendered_hash
+            try:
+                await self.update()
+            except ModelError:
+                # The message was deleted in the meantime
+                pass
+            else:
+                return 'unchanged' if self.rendered_hash == old_hash else 'updated'
+        await self.post()
+        return 'reposted'
+
+    def parsed(self):
+        """(parsed content, discord embed without footer) - only built once per content
+
+        Both are shared through PARSED_EMBED_CACHE and must not be modified"""
+        key = content_key(self.content)
+        entry = PARSED_EMBED_CACHE.get(key)
+        if entry is None:
+            content = parse_content(self.content)
+            entry = (content, build_discord_embed(content))
+            PARSED_EMBED_CACHE.set(key, entry)
+        return entry
+
+    def parsed_content(self):
+        return self.parsed()[0]
 
-        embed = DiscordEmbed(
-            title=content.get('title', None),
-            description=content.get('description', None),
-            url=content.get('url', None),
-            color=content.get('color', None) or 0x4f545c,
-        )
+    def construct_discord_embed(self):
+        embed = self.parsed()[1].copy()
 
-        for field in content.get('fields', []):
-            embed.add_field(
-                name=field['name'],
-                value=field['value'],
-                inline=field.get('inline', False),
-            )
+        user = self.client.get_user(self.user_id) if self.user_id else None
 
         embed.set_footer(
             text=f'ID: {self.id}' + (f' | @{user.name}' if user else "")
         )
 
-        author = content.get('author', None)
-        if author:
-            embed.set_author(
-                name=author.get('name', None),
-                url=author.get('url', DiscordEmbed.Empty),
-                icon_url=author.get('icon_url', DiscordEmbed.Empty),
-            )
-
         return embed
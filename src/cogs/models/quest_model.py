@@ -8,7 +8,7 @@ class QuestDB(BaseDB):
     def __init__(self, client):
         super().__init__(client, model_class=Quest)
 
-    def create_new(self, quest_id, date, multi, tier, rank_id, reward, title, description):
+    def _create_new(self, quest_id, date, multi, tier, rank_id, reward, title, description):
         with self.client.state.get_session() as session:
             if session.query(self.table_class).filter_by(id=quest_id).count() > 0:
                 raise DBError(f'Quest {quest_id} already exists')
@@ -47,10 +47,9 @@ class Quest(BaseModel):
         self.EmbedDB = EmbedDB(self.client)
 
     async def delete(self):
-        with self.client.state.get_session() as session:
-            status = session.query(type(self).table_type).filter_by(id=self.id).delete()
+        status = await super().delete()
         if status == 1:
-            embed = self.EmbedDB.query_one(id=self.embed_id)
+            embed = await self.EmbedDB.query_one(id=self.embed_id)
             status = await embed.delete()
         return status
 
@@ -140,9 +139,11 @@ class Quest(BaseModel):
         if not self.embed_id:
             return
         try:
-            embed = self.EmbedDB.query_one(id=self.embed_id)
-            embed.content = self.create_embed_content()
-            await embed.update()
+            embed = await self.EmbedDB.query_one(id=self.embed_id)
+            # content and rendered_hash are written together
+            with embed.batch():
+                embed.content = self.create_embed_content()
+                await embed.update()
         except ModelError:
             pass
 
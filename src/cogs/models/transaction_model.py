@@ -1,32 +1,599 @@
 # pylint: disable=E0402, E0211, E1101
-from sqlalchemy.orm.exc import NoResultFound
-from .core import BaseDB, BaseModel, TransactionData
+import csv
+import gzip
+import json
+from collections import namedtuple
+from datetime import datetime, timezone
+from io import BytesIO
+from operator import add, attrgetter, ge, mul, neg, sub
+from sqlalchemy import case, func, or_, text
+from .core import (
+    DBError, BaseDB, BaseModel, TransactionData, AccountBalanceData, AccountCheckpointData,
+    CharacterData, COIN_COLUMNS, REBUILD_BALANCES,
+)
+
+
+# Confirmed transactions an account needs since its latest checkpoint to get a new one
+CHECKPOINT_INTERVAL = 500
+
+CREATE_CHECKPOINTS = text(f'''
+    INSERT INTO account_checkpoints (account_id, transaction_id, date, {', '.join(COIN_COLUMNS)})
+    SELECT transactions.receiver_id, :high_water, :date,
+        {', '.join(f'COALESCE(latest.{c}, 0) + SUM(COALESCE(transactions.{c}, 0))' for c in COIN_COLUMNS)}
+    FROM transactions
+    LEFT JOIN account_checkpoints AS latest
+        ON latest.account_id = transactions.receiver_id
+        AND latest.transaction_id = (
+            SELECT MAX(transaction_id) FROM account_checkpoints
+            WHERE account_id = transactions.receiver_id
+        )
+    WHERE transactions.confirmed AND transactions.id <= :high_water
+        AND transactions.id > COALESCE(latest.transaction_id, 0)
+    GROUP BY transactions.receiver_id
+    HAVING COUNT(*) >= :min_rows
+''')
+
+# Balance of every account from its latest checkpoint plus the confirmed transactions after it,
+# the sums use the (receiver_id, confirmed) index to only read the rows after the checkpoint
+_CHECKPOINT_PLUS_DELTA = ', '.join(
+    f'''COALESCE(latest.{c}, 0) + (
+        SELECT COALESCE(SUM(transactions.{c}), 0) FROM transactions
+        WHERE transactions.receiver_id = accounts.account_id AND transactions.confirmed
+        AND transactions.id > COALESCE(latest.transaction_id, 0)
+    )''' for c in COIN_COLUMNS
+)
+REBUILD_BALANCES_FROM_CHECKPOINTS = (
+    'DELETE FROM account_balances',
+    f'''INSERT INTO account_balances (account_id, {', '.join(COIN_COLUMNS)})
+    SELECT accounts.account_id, {_CHECKPOINT_PLUS_DELTA}
+    FROM (SELECT DISTINCT receiver_id AS account_id FROM transactions WHERE confirmed) AS accounts
+    LEFT JOIN account_checkpoints AS latest
+        ON latest.account_id = accounts.account_id
+        AND latest.transaction_id = (
+            SELECT MAX(transaction_id) FROM account_checkpoints
+            WHERE account_id = accounts.account_id
+        )''',
+)
+
+VERIFY_CHECKPOINTS = text(f'''
+    SELECT checkpoints.account_id, checkpoints.transaction_id,
+        {', '.join(f'checkpoints.{c}' for c in COIN_COLUMNS)},
+        {', '.join(f'COALESCE(SUM(transactions.{c}), 0)' for c in COIN_COLUMNS)}
+    FROM account_checkpoints AS checkpoints
+    LEFT JOIN transactions
+        ON transactions.receiver_id = checkpoints.account_id
+        AND transactions.confirmed AND transactions.id <= checkpoints.transaction_id
+    GROUP BY checkpoints.id
+    ORDER BY checkpoints.account_id, checkpoints.transaction_id
+''')
+
+
+EXPORT_COLUMNS = (
+    'id', 'date', 'user_id', 'sender_id', 'receiver_id', 'description', 'confirmed', 'linked',
+    *COIN_COLUMNS,
+)
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_BATCH_SIZE = 1000
+
+# Worth of one coin of every currency in copper pieces
+COPPER_VALUE = {'platinum': 1000, 'gold': 100, 'electrum': 50, 'silver': 10, 'copper': 1}
+# Order in which the currencies are displayed
+CURRENCIES = ('platinum', 'gold', 'electrum', 'silver', 'copper')
+
+_coins_of_row = attrgetter(*COIN_COLUMNS)
+_display_index = tuple(COIN_COLUMNS.index(c) for c in CURRENCIES)
+_copper_values = tuple(COPPER_VALUE[c] for c in COIN_COLUMNS)
+# Change is made without electrum, like at any sane counter
+_change_coins = tuple(
+    (COIN_COLUMNS.index(c), COPPER_VALUE[c]) for c in ('platinum', 'gold', 'silver', 'copper')
+)
+
+
+class Coins(namedtuple('Coins', COIN_COLUMNS, defaults=(0,) * len(COIN_COLUMNS))):
+    """Amounts of every currency, stored as a tuple in COIN_COLUMNS order
+
+    +, - and unary - work per currency, a Coins object is true if any amount is not 0."""
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, row):
+        """Read the coins of a transaction/balance row, missing amounts (None) count as 0"""
+        return cls._make(amount or 0 for amount in _coins_of_row(row))
+
+    @classmethod
+    def make_change(cls, value):
+        """Pay an amount of copper pieces with as few coins as possible"""
+        sign = -1 if value < 0 else 1
+        rest = abs(value)
+        amounts = [0] * len(COIN_COLUMNS)
+        for index, worth in _change_coins:
+            amount, rest = divmod(rest, worth)
+            amounts[index] = sign * amount
+        return cls._make(amounts)
+
+    def __add__(self, other):
+        return self._make(map(add, self, other))
+
+    def __sub__(self, other):
+        return self._make(map(sub, self, other))
+
+    def __neg__(self):
+        return self._make(map(neg, self))
+
+    def __bool__(self):
+        return any(self)
+
+    @property
+    def value(self):
+        """Worth of all coins in copper pieces"""
+        return sum(map(mul, self, _copper_values))
+
+    def covers(self, other):
+        """Check if there are at least as many coins of every currency as in other"""
+        return all(map(ge, self, other))
+
+    def items(self):
+        """(currency, amount) pairs in display order"""
+        return tuple((c, self[index]) for c, index in zip(CURRENCIES, _display_index))
+
+
+def coin_sums():
+    """SQL aggregate columns summing every currency of TransactionData"""
+    return tuple(func.sum(func.coalesce(getattr(TransactionData, c), 0)) for c in COIN_COLUMNS)
+
+
+def copper_value(table):
+    """SQL expression for the worth of a row of table (all currencies) in copper pieces"""
+    return sum(COPPER_VALUE[c] * func.coalesce(getattr(table, c), 0) for c in COIN_COLUMNS)
 
 
 class TransactionDB(BaseDB):
     def __init__(self, client):
         super().__init__(client, model_class=Transaction)
 
-    def get_history_for_account(self, receiver_id, num=12, start=0, search_string=None):
-        search_string = f'%{search_string}%' if search_string else '%'
-        with self.client.state.get_session() as session:
-            try:
-                data = (
-                    session.query(TransactionData)
-                    .filter_by(receiver_id=receiver_id)
-                    .filter(self.table_class.description.like(search_string))
-                    .order_by(TransactionData.id.desc())
-                    .limit(num+start)
-                    .all()[start:num+start]
-                )
-            except NoResultFound:
-                return None
+    async def get_history_for_account(self, receiver_id, limit=12, before_id=None, search_string=None):
+        """Get up to limit transactions of an account, newest first
+
+        Pass the id of the last transaction of a page as before_id to get the next page.
+        The query walks the receiver_id index in id order, so every page costs the same."""
+        return await self.client.state.run(
+            self._get_history_for_account, receiver_id,
+            limit=limit, before_id=before_id, search_string=search_string,
+        )
+
+    def _get_history_for_account(self, receiver_id, limit=12, before_id=None, search_string=None):
+        with self.client.state.get_session() as session:
+            query = session.query(TransactionData).filter_by(receiver_id=receiver_id)
+            if before_id is not None:
+                query = query.filter(TransactionData.id < before_id)
+            if search_string:
+                query = query.filter(TransactionData.description.like(f'%{search_string}%'))
+            data = query.order_by(TransactionData.id.desc()).limit(limit).all()
         if len(data) == 0:
             return None
         else:
             return tuple(self.model_class(self.client, d) for d in data)
 
-    def create_new(self, date, user_id, receiver_id, sender_id, description=None, confirmed=0, platinum=None, electrum=None, gold=None, silver=None, copper=None, linked=None):
+    @property
+    def full_text_search(self):
+        return self.client.state.full_text_search
+
+    async def search_history(self, receiver_id, search_string, limit=12, offset=0):
+        """Full text search in the descriptions of an account's transactions, best match first
+
+        Every word of search_string has to appear in the description, either as a whole word
+        or as the start of one. Only available if full_text_search is True."""
+        return await self.client.state.run(
+            self._search_history, receiver_id, search_string, limit=limit, offset=offset
+        )
+
+    def _search_history(self, receiver_id, search_string, limit=12, offset=0):
+        # Quote every word so user input can't be parsed as FTS5 query syntax
+        words = ['"' + word.replace('"', '""') + '"*' for word in search_string.split()]
+        if not words:
+            return None
+        statement = text(
+            '''SELECT transactions.* FROM transactions_fts
+            JOIN transactions ON transactions.id = transactions_fts.rowid
+            WHERE transactions_fts MATCH :match AND transactions.receiver_id = :receiver_id
+            ORDER BY transactions_fts.rank, transactions.id DESC
+            LIMIT :limit OFFSET :offset'''
+        )
+        with self.client.state.get_session() as session:
+            data = (
+                session.query(TransactionData)
+                .from_statement(statement)
+                .params(match=' '.join(words), receiver_id=receiver_id, limit=limit, offset=offset)
+                .all()
+            )
+        if len(data) == 0:
+            return None
+        else:
+            return tuple(self.model_class(self.client, d) for d in data)
+
+    async def get_pending(self, limit=10, after_id=None):
+        """Get up to limit unconfirmed transactions, oldest first
+
+        Pass the id of the last transaction of a page as after_id to get the next page."""
+        return await self.client.state.run(self._get_pending, limit=limit, after_id=after_id)
+
+    def _get_pending(self, limit=10, after_id=None):
+        with self.client.state.get_session() as session:
+            query = session.query(TransactionData).filter_by(confirmed=False)
+            if after_id is not None:
+                query = query.filter(TransactionData.id > after_id)
+            data = query.order_by(TransactionData.id).limit(limit).all()
+        if len(data) == 0:
+            return None
+        else:
+            return tuple(self.model_class(self.client, d) for d in data)
+
+    async def get_balance(self, account_id):
+        """Read the maintained balance of an account as Coins"""
+        return await self.client.state.run(self._get_balance, account_id)
+
+    def _get_balance(self, account_id):
+        with self.client.state.get_session() as session:
+            data = session.query(AccountBalanceData).filter_by(account_id=account_id).one_or_none()
+        if data is None:
+            return None
+        return Coins.from_row(data)
+
+    async def sum_for_account(self, receiver_id, confirmed=True):
+        """Sum up the transactions of an account inside the database, returns Coins
+
+        confirmed=None sums all transactions regardless of their state"""
+        return await self.client.state.run(self._sum_for_account, receiver_id, confirmed=confirmed)
+
+    def _sum_for_account(self, receiver_id, confirmed=True):
+        checkpoint = None
+        with self.client.state.get_session() as session:
+            query = session.query(*coin_sums()).filter(TransactionData.receiver_id == receiver_id)
+            if confirmed is not None:
+                query = query.filter(TransactionData.confirmed == bool(confirmed))
+            if confirmed:
+                # Only the transactions after the latest checkpoint have to be summed up
+                checkpoint = (
+                    session.query(AccountCheckpointData)
+                    .filter_by(account_id=receiver_id)
+                    .order_by(AccountCheckpointData.transaction_id.desc())
+                    .first()
+                )
+                if checkpoint is not None:
+                    query = query.filter(TransactionData.id > checkpoint.transaction_id)
+            row = query.one()
+        coins = Coins._make(amount or 0 for amount in row)
+        if checkpoint is not None:
+            coins += Coins.from_row(checkpoint)
+        return coins
+
+    async def create_checkpoints(self, min_rows=CHECKPOINT_INTERVAL):
+        """Store the balance of every account with at least min_rows new confirmed transactions
+
+        Returns the number of checkpoints created"""
+        return await self.client.state.run(self._create_checkpoints, min_rows)
+
+    def _create_checkpoints(self, min_rows=CHECKPOINT_INTERVAL):
+        with self.client.state.get_session() as session:
+            high_water = session.query(func.max(TransactionData.id)).scalar()
+            if high_water is None:
+                return 0
+            result = session.execute(CREATE_CHECKPOINTS, {
+                'high_water': high_water,
+                'date': datetime.now(tz=timezone.utc).isoformat(),
+                'min_rows': max(min_rows, 1),
+            })
+            return result.rowcount
+
+    async def verify_checkpoints(self):
+        """Compare every checkpoint with a full recomputation of its balance
+
+        Returns a list of (account_id, transaction_id, stored, expected) tuples for every
+        checkpoint that drifted"""
+        return await self.client.state.run(self._verify_checkpoints)
+
+    def _verify_checkpoints(self):
+        with self.client.state.get_session() as session:
+            rows = session.execute(VERIFY_CHECKPOINTS).all()
+        num = len(COIN_COLUMNS)
+        drift = []
+        for account_id, transaction_id, *coins in rows:
+            stored, expected = Coins._make(coins[:num]), Coins._make(coins[num:])
+            if stored != expected:
+                drift.append((account_id, transaction_id, stored, expected))
+        return drift
+
+    async def rebuild_balances(self, full=False):
+        """Recompute the whole account_balances table, returns the number of accounts
+
+        Every balance starts at the latest checkpoint of its account, so only the transactions
+        after it are summed up. full=True drops all checkpoints and sums up every transaction."""
+        return await self.client.state.run(self._rebuild_balances, full=full)
+
+    def _rebuild_balances(self, full=False):
+        with self.client.state.get_session() as session:
+            if full:
+                session.query(AccountCheckpointData).delete()
+                statements = REBUILD_BALANCES
+            else:
+                statements = REBUILD_BALANCES_FROM_CHECKPOINTS
+            for statement in statements:
+                session.execute(text(statement))
+            return session.query(AccountBalanceData).count()
+
+    async def verify_balances(self):
+        """Compare the maintained balances with a full recomputation
+
+        Returns a list of (account_id, stored, expected) tuples for every account that drifted"""
+        return await self.client.state.run(self._verify_balances)
+
+    def _verify_balances(self):
+        with self.client.state.get_session() as session:
+            stored = {
+                row.account_id: Coins.from_row(row)
+                for row in session.query(AccountBalanceData).all()
+            }
+            expected = {
+                row[0]: Coins._make(row[1:])
+                for row in session.query(TransactionData.receiver_id, *coin_sums())
+                .filter(TransactionData.confirmed)
+                .group_by(TransactionData.receiver_id)
+                .all()
+            }
+        zero = Coins()
+        drift = []
+        for account_id in sorted(stored.keys() | expected.keys()):
+            stored_coins = stored.get(account_id, zero)
+            expected_coins = expected.get(account_id, zero)
+            if stored_coins != expected_coins:
+                drift.append((account_id, stored_coins, expected_coins))
+        return drift
+
+    async def get_leaderboard(self, limit=10):
+        """Get the accounts with the highest balance (by worth in copper), richest first
+
+        Returns a list of (account_id, display_name, coins, value) tuples"""
+        return await self.client.state.run(self._get_leaderboard, limit=limit)
+
+    def _get_leaderboard(self, limit=10):
+        value = copper_value(AccountBalanceData)
+        with self.client.state.get_session() as session:
+            rows = (
+                session.query(
+                    AccountBalanceData.account_id,
+                    CharacterData.display_name,
+                    value,
+                    *(getattr(AccountBalanceData, c) for c in COIN_COLUMNS),
+                )
+                .outerjoin(CharacterData, CharacterData.id == AccountBalanceData.account_id)
+                .order_by(value.desc(), AccountBalanceData.account_id)
+                .limit(limit)
+                .all()
+            )
+        return [
+            (account_id, display_name, Coins._make(coins), total)
+            for account_id, display_name, total, *coins in rows
+        ]
+
+    async def get_supply(self):
+        """Sum up the balances of all accounts
+
+        Returns a (number of accounts, coins, value in copper) tuple"""
+        return await self.client.state.run(self._get_supply)
+
+    def _get_supply(self):
+        with self.client.state.get_session() as session:
+            num_accounts, total, *coins = session.query(
+                func.count(AccountBalanceData.account_id),
+                func.coalesce(func.sum(copper_value(AccountBalanceData)), 0),
+                *(func.coalesce(func.sum(getattr(AccountBalanceData, c)), 0) for c in COIN_COLUMNS),
+            ).one()
+        return num_accounts, Coins._make(coins), total
+
+    async def get_volume(self, periods=6):
+        """Get the confirmed transaction volume of the latest months, newest first
+
+        Returns a list of (month, number of transactions, copper in, copper out) tuples"""
+        return await self.client.state.run(self._get_volume, periods=periods)
+
+    def _get_volume(self, periods=6):
+        # Dates are stored as ISO strings, their first 7 characters are the month
+        month = func.substr(TransactionData.date, 1, 7)
+        value = copper_value(TransactionData)
+        with self.client.state.get_session() as session:
+            rows = (
+                session.query(
+                    month,
+                    func.count(TransactionData.id),
+                    func.sum(case((value > 0, value), else_=0)),
+                    func.sum(case((value < 0, -value), else_=0)),
+                )
+                .filter(TransactionData.confirmed)
+                .group_by(month)
+                .order_by(month.desc())
+                .limit(periods)
+                .all()
+            )
+        return [tuple(row) for row in rows]
+
+    async def export(self, receiver_id=None, since=None, file_format='csv'):
+        """Write the transactions (of one account / starting at a date) to a gzipped buffer
+
+        file_format is 'csv' or 'jsonl'. The rows are streamed from the database in batches,
+        so only the compressed file is held in memory. Returns (buffer, number of rows)."""
+        return await self.client.state.run(
+            self._export, receiver_id=receiver_id, since=since, file_format=file_format
+        )
+
+    def _export(self, receiver_id=None, since=None, file_format='csv'):
+        if file_format not in EXPORT_FORMATS:
+            raise DBError(f'Unknown export format {file_format}')
+        buffer = BytesIO()
+        num_rows = 0
+        with gzip.open(buffer, 'wt', encoding='utf-8', newline='') as stream:
+            if file_format == 'csv':
+                writer = csv.writer(stream)
+                writer.writerow(EXPORT_COLUMNS)
+                write_row = writer.writerow
+            else:
+                def write_row(row):
+                    stream.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n')
+
+            with self.client.state.get_session() as session:
+                query = session.query(*(getattr(TransactionData, c) for c in EXPORT_COLUMNS))
+                if receiver_id is not None:
+                    query = query.filter(TransactionData.receiver_id == receiver_id)
+                if since is not None:
+                    # ISO dates compare correctly as strings
+                    query = query.filter(TransactionData.date >= since)
+                for row in query.order_by(TransactionData.id).yield_per(EXPORT_BATCH_SIZE):
+                    write_row(row)
+                    num_rows += 1
+        buffer.seek(0)
+        return buffer, num_rows
+
+    async def confirm_many(self, transaction_ids):
+        """Confirm several transactions and their linked partners with one UPDATE
+
+        Returns a (transaction_id, status, linked_to) tuple for every requested id and every
+        linked partner it pulled in. status is 'confirmed', 'already confirmed' or 'unknown'."""
+        return await self.client.state.run(self._confirm_many, transaction_ids)
+
+    def _confirm_many(self, transaction_ids):
+        with self.client.state.get_session() as session:
+            rows = self._query_with_partners(session, transaction_ids)
+            report = []
+            for transaction_id, linked_to in self._with_partners(rows, transaction_ids):
+                row = rows.get(transaction_id)
+                if row is None:
+                    status = 'unknown'
+                else:
+                    status = 'already confirmed' if row.confirmed else 'confirmed'
+                report.append((transaction_id, status, linked_to))
+            to_confirm = [transaction_id for transaction_id, status, _ in report if status == 'confirmed']
+            if to_confirm:
+                session.query(TransactionData).filter(TransactionData.id.in_(to_confirm)).update(
+                    {'confirmed': True}, synchronize_session=False
+                )
+        return report
+
+    async def delete_many(self, transaction_ids, account_id=None):
+        """Delete several transactions and their linked partners with one DELETE
+
+        With account_id only deposits/withdrawals of that account may be deleted.
+        Returns a (transaction_id, status, linked_to) tuple for every requested id and every
+        linked partner it pulled in. status is 'deleted', 'forbidden' or 'unknown'."""
+        return await self.client.state.run(self._delete_many, transaction_ids, account_id)
+
+    def _delete_many(self, transaction_ids, account_id=None):
+        with self.client.state.get_session() as session:
+            rows = self._query_with_partners(session, transaction_ids)
+            report = []
+            for transaction_id, linked_to in self._with_partners(rows, transaction_ids):
+                row = rows.get(transaction_id)
+                if row is None:
+                    status = 'unknown'
+                elif account_id is not None and not row.sender_id == row.receiver_id == account_id:
+                    status = 'forbidden'
+                else:
+                    status = 'deleted'
+                report.append((transaction_id, status, linked_to))
+            to_delete = [transaction_id for transaction_id, status, _ in report if status == 'deleted']
+            if to_delete:
+                session.query(TransactionData).filter(TransactionData.id.in_(to_delete)).delete(
+                    synchronize_session=False
+                )
+        return report
+
+    @staticmethod
+    def _query_with_partners(session, transaction_ids):
+        """Load the requested transactions and every transaction linked to them by id"""
+        rows = (
+            session.query(
+                TransactionData.id,
+                TransactionData.linked,
+                TransactionData.confirmed,
+                TransactionData.sender_id,
+                TransactionData.receiver_id,
+            )
+            .filter(or_(
+                TransactionData.id.in_(transaction_ids),
+                TransactionData.linked.in_(transaction_ids),
+            ))
+            .all()
+        )
+        return {row.id: row for row in rows}
+
+    @staticmethod
+    def _with_partners(rows, transaction_ids):
+        """Yield (transaction_id, linked_to) for the requested ids followed by their partners"""
+        seen = set()
+        for transaction_id in transaction_ids:
+            if transaction_id in seen:
+                continue
+            seen.add(transaction_id)
+            yield transaction_id, None
+            row = rows.get(transaction_id)
+            if row is not None and row.linked in rows and row.linked not in seen:
+                seen.add(row.linked)
+                yield row.linked, transaction_id
+
+    async def create_transfer(self, date, user_id, sender_id, receiver_id, coins, description=None, confirmed=0):
+        """Book a deposit/withdrawal or a transfer (of Coins) between two accounts in one DB transaction
+
+        A transfer inserts a second transaction for the sender with the negated amounts and links
+        both. Raises DBError and writes nothing if a booking would overdraw an account."""
+        return await self.client.state.run(
+            self._create_transfer, date, user_id, sender_id, receiver_id, coins,
+            description=description, confirmed=confirmed,
+        )
+
+    def _create_transfer(self, date, user_id, sender_id, receiver_id, coins, description=None, confirmed=0):
+        deltas = {receiver_id: coins}
+        if sender_id != receiver_id:
+            deltas[sender_id] = -coins
+
+        with self.client.state.get_session() as session:
+            data = TransactionData(
+                date=date,
+                user_id=user_id,
+                receiver_id=receiver_id,
+                sender_id=sender_id,
+                description=description,
+                confirmed=confirmed,
+                **coins._asdict(),
+            )
+            session.add(data)
+            session.flush()
+
+            if sender_id != receiver_id:
+                linked_data = TransactionData(
+                    date=date,
+                    user_id=user_id,
+                    receiver_id=sender_id,
+                    sender_id=receiver_id,
+                    description=description,
+                    confirmed=confirmed,
+                    linked=data.id,
+                    **deltas[sender_id]._asdict(),
+                )
+                session.add(linked_data)
+                session.flush()
+                data.linked = linked_data.id
+
+            for account_id, delta in deltas.items():
+                row = session.query(AccountBalanceData).filter_by(account_id=account_id).one_or_none()
+                balance = Coins.from_row(row) if row else Coins()
+                # Confirmed bookings are already part of the balance through the triggers
+                if not confirmed:
+                    balance += delta
+                # Only the currencies this booking takes from may not end up below 0
+                if any(amount < 0 and new_amount < 0 for amount, new_amount in zip(delta, balance)):
+                    raise DBError('Not enough money in account')
+
+        return self.model_class(self.client, data)
+
+    def _create_new(self, date, user_id, receiver_id, sender_id, description=None, confirmed=0, platinum=None, electrum=None, gold=None, silver=None, copper=None, linked=None):
         data = TransactionData(
             date=date,
             user_id=user_id,
@@ -54,7 +621,7 @@ class Transaction(BaseModel):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    async def delete(self):
+    def _delete(self):
         with self.client.state.get_session() as session:
             status = session.query(type(self).table_type).filter_by(id=self.id).delete()
             if status == 1:
@@ -1,22 +1,36 @@
 # pylint: disable=E0402, E0211, E1101
 from sqlalchemy.orm.exc import NoResultFound
-from .core import DBError, BaseDB, BaseModel, UserData
+from .core import DBError, ModelCache, BaseDB, BaseModel, UserData
+
+USER_CACHE = ModelCache()
 
 
 class UserDB(BaseDB):
+    cache = USER_CACHE
+
     def __init__(self, client):
         super().__init__(client, model_class=User)
 
-    def query_one(self, **query_kwargs):
+    async def query_one(self, **query_kwargs):
+        user = USER_CACHE.get(query_kwargs['id'])
+        if user is not None:
+            return user
+        return await super().query_one(**query_kwargs)
+
+    def _query_one(self, **query_kwargs):
+        user = USER_CACHE.get(query_kwargs['id'])
+        if user is not None:
+            return user
+
         with self.client.state.get_session() as session:
             try:
                 data = session.query(self.table_class).filter_by(**query_kwargs).one()
             except NoResultFound:
-                return self.create_new(query_kwargs['id'])
+                return self._create_new(query_kwargs['id'])
 
-        return self.model_class(self.client, data)
+        return self._from_cache(data)
 
-    def create_new(self, user_id, active_char=None):
+    def _create_new(self, user_id, active_char=None):
         with self.client.state.get_session() as session:
             if session.query(UserData).filter_by(id=user_id).count() > 0:
                 raise DBError(f'User {user_id} already exists')
@@ -28,7 +42,7 @@ class UserDB(BaseDB):
         with self.client.state.get_session() as session:
             session.add(data)
 
-        return self.model_class(self.client, data)
+        return self._from_cache(data)
 
 
 class User(BaseModel):
@@ -37,6 +51,10 @@ class User(BaseModel):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def invalidate_cache(self):
+        if USER_CACHE.get(self.id) is not self:
+            USER_CACHE.invalidate(self.id)
+
     @property
     def active_char(self):
         return self.data.active_char
@@ -0,0 +1,93 @@
+"""Helper to show paged embeds in a single discord message.
+
+The pages are requested one at a time through a coroutine, so only the page
+that is currently shown has to be loaded.
+"""
+import asyncio
+from discord import errors as discord_errors
+
+# Limits of a single embed, the total length leaves some room for title and footer
+EMBED_MAX_LENGTH = 5800
+EMBED_MAX_FIELDS = 25
+
+
+def fill_embed(embed, fields, inline=False):
+    """Add (name, value) fields to embed until discord's limits are reached
+
+    The first field is always added. Returns the number of fields that were added."""
+    added = 0
+    for name, value in fields:
+        if added and (
+            len(embed.fields) >= EMBED_MAX_FIELDS
+            or len(embed) + len(name) + len(value) > EMBED_MAX_LENGTH
+        ):
+            break
+        embed.add_field(inline=inline, name=name, value=value)
+        added += 1
+    return added
+
+
+class ReactionPager:
+    """Flip through pages of a message with reactions
+
+    fetch_page(cursor) is a coroutine that returns (embed, next_cursor) for the page starting
+    at cursor. next_cursor is None on the last page. The cursors of the pages that were shown
+    are kept on a stack so the previous page can be loaded again.
+    """
+    PREVIOUS = '◀️'
+    NEXT = '▶️'
+
+    def __init__(self, client, fetch_page, timeout=120):
+        self.client = client
+        self.fetch_page = fetch_page
+        self.timeout = timeout
+
+    async def start(self, ctx, cursor=None):
+        cursors = [cursor]
+        embed, next_cursor = await self.fetch_page(cursor)
+        if next_cursor is None:
+            return await ctx.send(embed=embed)
+
+        embed.set_footer(text=f'Page {len(cursors)}')
+        message = await ctx.send(embed=embed)
+        await message.add_reaction(self.PREVIOUS)
+        await message.add_reaction(self.NEXT)
+
+        def check(reaction, user):
+            return (
+                reaction.message.id == message.id
+                and user.id == ctx.author.id
+                and str(reaction.emoji) in (self.PREVIOUS, self.NEXT)
+            )
+
+        while True:
+            try:
+                reaction, user = await self.client.wait_for(
+                    'reaction_add', timeout=self.timeout, check=check
+                )
+            except asyncio.TimeoutError:
+                break
+
+            await self.try_remove_reaction(message, reaction.emoji, user)
+            if str(reaction.emoji) == self.NEXT and next_cursor is not None:
+                cursors.append(next_cursor)
+            elif str(reaction.emoji) == self.PREVIOUS and len(cursors) > 1:
+                cursors.pop()
+            else:
+                continue
+
+            embed, next_cursor = await self.fetch_page(cursors[-1])
+            embed.set_footer(text=f'Page {len(cursors)}')
+            await message.edit(embed=embed)
+
+        try:
+            await message.clear_reactions()
+        except discord_errors.HTTPException:
+            pass
+        return message
+
+    async def try_remove_reaction(self, message, emoji, user):
+        try:
+            await message.remove_reaction(emoji, user)
+        except discord_errors.HTTPException:
+            pass